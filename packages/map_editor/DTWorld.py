@@ -1,10 +1,14 @@
+import weakref
 from typing import Optional
 
 from duckietown_world.structure.duckietown_map import DuckietownMap
 from duckietown_world.structure.map_factory import MapFactory
+from frame_poses import FramePoseCache
 import os
 
 DT_WORLD = None
+# caches live while their maps live, cache refers to its map weakly
+POSE_CACHES: 'weakref.WeakKeyDictionary[DuckietownMap, FramePoseCache]' = weakref.WeakKeyDictionary()
 
 
 def get_dt_world(map_name=None) -> DuckietownMap:
@@ -14,9 +18,35 @@ def get_dt_world(map_name=None) -> DuckietownMap:
             DT_WORLD = MapFactory.load_map(os.path.abspath(map_name))
         else:
             DT_WORLD = MapFactory.load_map(os.path.abspath("maps/empty"))
+        get_pose_cache(DT_WORLD)
     return DT_WORLD
 
 
 def get_new_dt_world(map_name: Optional[str] = None) -> Optional[DuckietownMap]:
     if map_name:
-        return MapFactory.load_map(os.path.abspath(map_name))
+        dm = MapFactory.load_map(os.path.abspath(map_name))
+        get_pose_cache(dm)
+        return dm
+
+
+def get_pose_cache(dm: Optional[DuckietownMap] = None) -> FramePoseCache:
+    """
+    Get cache of world poses of frames for dt-world map
+    :param dm: DuckietownMap, if None - current dt-world map
+    :return: FramePoseCache
+    """
+    if dm is None:
+        dm = get_dt_world()
+    cache = POSE_CACHES.get(dm)
+    if cache is None:
+        cache = POSE_CACHES[dm] = FramePoseCache(dm)
+    return cache
+
+
+def drop_pose_cache(dm: DuckietownMap):
+    """
+    Forget cache of world poses of dt-world map, it will be rebuilt on next get_pose_cache
+    :param dm: DuckietownMap
+    :return: -
+    """
+    POSE_CACHES.pop(dm, None)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Measure time of repeated paste at the edge of large map: each paste extends the map to the left and up
+(MapEditor.copySelection w/ negative destination), so it's a cost of growing of tile layer.
+
+python3 bench_border_growth.py --size 500 --pastes 200
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List
+
+from classes.mapTile import MapTile
+from map import DuckietownMap
+from mapEditor import MapEditor
+
+KINDS = ('straight', 'curve_left', 'asphalt', 'floor', '3way_left', '4way')
+
+
+def create_editor(size: int) -> MapEditor:
+    dt_map = DuckietownMap()
+    dt_map.set_tile_layer([[MapTile(KINDS[(y * size + x) % len(KINDS)], 90 * (x % 4)) for x in range(size)]
+                           for y in range(size)])
+    # editor compacts tile layer before the first edit, it isn't measured
+    dt_map.compact_tile_layer()
+    return MapEditor(dt_map, None)
+
+
+def measure(editor: MapEditor, pastes: int, step: int) -> float:
+    """
+    :return: time per paste in milliseconds
+    """
+    background = MapTile('empty')
+    selection = [0, 0, step, step]
+    begin = time.perf_counter()
+    for _ in range(pastes):
+        editor.copySelection(selection, -step, -step, background)
+    return (time.perf_counter() - begin) / pastes * 1e3
+
+
+def main(argv: List[str]) -> int:
+    parser = ArgumentParser(description="Measure time of repeated paste at the edge of large map")
+    parser.add_argument('--size', type=int, default=500, help="width and height of map in tiles")
+    parser.add_argument('--pastes', type=int, default=200, help="count of pastes")
+    parser.add_argument('--step', type=int, default=2, help="size of pasted block, map grows by it each paste")
+    args = parser.parse_args(argv)
+    print('{:<12}{:>12}{:>16}'.format('storage', 'size', 'paste, ms'))
+    editor = create_editor(args.size)
+    paste_time = measure(editor, args.pastes, args.step)
+    height, width = editor.map.get_tile_layer().data.shape
+    print('{:<12}{:>12}{:>16.3f}'.format('TileGrid', '{}x{}'.format(height, width), paste_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
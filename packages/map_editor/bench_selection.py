@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Measure time of selection of objects by rectangle on key press (MainWindow.keyPressEvent):
+scan of all objects, as it was done before SelectionModel, and queries of SelectionModel.
+Also measure hit-test of click (nearest object within radius) by scan and by SpatialGrid.
+
+python3 bench_selection.py --count 5000 --presses 200
+"""
+import math
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List
+
+from classes.mapObjects import CityObject
+from layers.layer_type import LayerType
+from map import DuckietownMap
+from selection_model import SelectionModel
+from spatial_index import SpatialGrid
+
+KINDS = ('duckie', 'tree', 'house', 'bus', 'truck', 'cone', 'barrier', 'building')
+NUDGE = .1
+HIT_RADIUS = .15  # as DELTA_EUCLIDEAN_DISTANCE of MapViewer
+
+
+def create_map(count: int, size: float) -> DuckietownMap:
+    rnd = random.Random(0)
+    dt_map = DuckietownMap()
+    dt_map.get_layer_by_type(LayerType.ITEMS).add_elem([
+        CityObject({'kind': KINDS[i % len(KINDS)], 'pos': [rnd.uniform(0, size), rnd.uniform(0, size)],
+                    'rotate': 0, 'height': .1, 'optional': False, 'static': True})
+        for i in range(count)])
+    return dt_map
+
+
+def scan_select(dt_map: DuckietownMap, rect: List[float], selected: list) -> bool:
+    # selection before SelectionModel: all objects are visited and checked against list of selected ones
+    new_selected = False
+    for item in dt_map.get_objects_from_layers():
+        x, y = item.position
+        if rect[0] < x < rect[2] and rect[1] < y < rect[3] and item not in selected:
+            selected.append(item)
+            new_selected = True
+    return new_selected
+
+
+def measure_scan(dt_map: DuckietownMap, rect: List[float], presses: int) -> float:
+    """
+    :return: time per key press in milliseconds, selected objects are nudged on each press
+    """
+    selected = []
+    begin = time.perf_counter()
+    for _ in range(presses):
+        scan_select(dt_map, rect, selected)
+        for item in selected:
+            item.position[0] += NUDGE
+    return (time.perf_counter() - begin) / presses * 1e3
+
+
+def measure_index(dt_map: DuckietownMap, rect: List[float], presses: int) -> (float, float):
+    """
+    :return: (time of the first selection, which builds index, time per next key press) in milliseconds,
+    selected objects are nudged on each press
+    """
+    selection = SelectionModel(dt_map)
+    begin = time.perf_counter()
+    selection.select_rect(rect)
+    first = time.perf_counter() - begin
+    begin = time.perf_counter()
+    for _ in range(presses):
+        selection.select_rect(rect)
+        selection.move_selected(NUDGE, 0)
+    return first * 1e3, (time.perf_counter() - begin) / presses * 1e3
+
+
+def measure_hit_test(dt_map: DuckietownMap, clicks: int, size: float) -> (float, float):
+    """
+    :return: (time per click of scan, time per click of SpatialGrid) in milliseconds
+    """
+    rnd = random.Random(1)
+    points = [(rnd.uniform(0, size), rnd.uniform(0, size)) for _ in range(clicks)]
+    objects = list(dt_map.get_objects_from_layers())
+    begin = time.perf_counter()
+    scan_found = []
+    for x, y in points:
+        best, best_distance = None, HIT_RADIUS
+        for i, item in enumerate(objects):
+            distance = math.hypot(item.position[0] - x, item.position[1] - y)
+            if distance <= best_distance:
+                best, best_distance = i, distance
+        scan_found.append(best)
+    scan_time = (time.perf_counter() - begin) / clicks * 1e3
+    grid = SpatialGrid()
+    grid.build((i, *item.position) for i, item in enumerate(objects))
+    begin = time.perf_counter()
+    grid_found = [grid.nearest(x, y, HIT_RADIUS) for x, y in points]
+    grid_time = (time.perf_counter() - begin) / clicks * 1e3
+    if [i is None for i in scan_found] != [i is None for i in grid_found]:
+        raise AssertionError("Hit-test by index differs from scan")
+    return scan_time, grid_time
+
+
+def main(argv: List[str]) -> int:
+    parser = ArgumentParser(description="Measure time of selection of objects on key press")
+    parser.add_argument('--count', type=int, default=5000, help="count of objects")
+    parser.add_argument('--size', type=float, default=50., help="side of map in tiles")
+    parser.add_argument('--presses', type=int, default=200, help="count of key presses")
+    parser.add_argument('--rect', type=float, default=5., help="side of selection rectangle in tiles")
+    args = parser.parse_args(argv)
+    rect = [0., 0., args.rect, args.rect]
+    scan_time = measure_scan(create_map(args.count, args.size), rect, args.presses)
+    first_time, index_time = measure_index(create_map(args.count, args.size), rect, args.presses)
+    hit_scan_time, hit_grid_time = measure_hit_test(create_map(args.count, args.size), args.presses, args.size)
+    print('{:<26}{:>12}'.format('selection', 'ms'))
+    print('{:<26}{:>12.3f}'.format('scan, per key press', scan_time))
+    print('{:<26}{:>12.3f}'.format('index, first selection', first_time))
+    print('{:<26}{:>12.3f}'.format('index, per key press', index_time))
+    print('{:<26}{:>12.3f}'.format('hit-test, scan', hit_scan_time))
+    print('{:<26}{:>12.3f}'.format('hit-test, index', hit_grid_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
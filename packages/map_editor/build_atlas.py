@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Pack sprites of the map editor into a few atlas images and write JSON manifest (rects, sizes and SHA-1 of
+source files), so the editor reads a handful of files at startup instead of a file per sprite.
+The editor compares only names and sizes of files w/ manifest, `--check` compares content (e.g. on CI).
+
+python3 build_atlas.py --max-size 4096
+python3 build_atlas.py --check
+"""
+import os
+
+# must be set before creating of QApplication
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import hashlib
+import json
+import logging
+import sys
+from argparse import ArgumentParser
+from typing import Dict, List, Tuple
+
+from PyQt5 import QtCore, QtGui
+
+from logger import init_logger
+from sprite_library import ATLAS_GROUPS, ATLAS_MANIFEST_PATH, ATLAS_MANIFEST_VERSION, list_sprite_files
+
+logger = logging.getLogger('root')
+
+EDITOR_DIR = os.path.dirname(os.path.abspath(__file__))  # sprites are read relative to it
+DEFAULT_MAX_SIZE = 4096
+PADDING = 1  # transparent pixels between sprites, so smooth scaling doesn't bleed neighbours in
+
+
+def get_file_digest(file_path: str) -> str:
+    """
+    :return: SHA-1 of content of file, hex
+    """
+    with open(file_path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def pack(sizes: List[Tuple[int, int]], max_size: int) -> List[Tuple[int, int, int]]:
+    """
+    Place rects into atlases by shelves: rects are sorted by height and put left to right,
+    a new shelf is started when the row is full, a new atlas - when the atlas is full
+    :param sizes: list of (width, height) of rects
+    :param max_size: max width and height of atlas, pixels
+    :return: list of (atlas index, x, y) in order of sizes
+    """
+    places = [None] * len(sizes)
+    atlas, x, y, shelf_height = 0, 0, 0, 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        width, height = sizes[i]
+        if width > max_size or height > max_size:
+            raise ValueError("Sprite {}x{} doesn't fit atlas {}x{}".format(width, height, max_size, max_size))
+        if x + width > max_size:
+            x, y, shelf_height = 0, y + shelf_height + PADDING, 0
+        if y + height > max_size:
+            atlas, x, y, shelf_height = atlas + 1, 0, 0, 0
+        places[i] = (atlas, x, y)
+        x += width + PADDING
+        shelf_height = max(shelf_height, height)
+    return places
+
+
+def build_atlas(output_dir: str, max_size: int = DEFAULT_MAX_SIZE) -> str:
+    """
+    Build atlases and manifest from sprite directories of the editor
+    :param output_dir: directory of atlases and manifest
+    :param max_size: max width and height of atlas, pixels
+    :return: path of manifest
+    """
+    # all files of directories are listed, so adding, removing or changing of any file makes atlas stale
+    entries, images = [], []
+    groups = {}
+    for group, dir_paths in ATLAS_GROUPS.items():
+        groups[group] = {}
+        for dir_path in dir_paths:
+            sources = groups[group][dir_path] = {}
+            for filename, file_path in sorted(list_sprite_files(dir_path)):
+                sources[filename] = {'size': os.path.getsize(file_path), 'sha1': get_file_digest(file_path)}
+                image = QtGui.QImage()
+                if not image.load(file_path):
+                    logger.warning("Can't load sprite '{}', skipped".format(file_path))
+                    continue
+                entries.append(sources[filename])
+                images.append(image.convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied))
+    places = pack([(image.width(), image.height()) for image in images], max_size)
+
+    extents: Dict[int, Tuple[int, int]] = {}
+    for (atlas, x, y), image in zip(places, images):
+        width, height = extents.get(atlas, (0, 0))
+        extents[atlas] = (max(width, x + image.width()), max(height, y + image.height()))
+    atlases = []
+    for atlas in sorted(extents):
+        atlas_image = QtGui.QImage(*extents[atlas], QtGui.QImage.Format_ARGB32_Premultiplied)
+        atlas_image.fill(QtCore.Qt.transparent)
+        atlases.append(atlas_image)
+    painters = [QtGui.QPainter(atlas_image) for atlas_image in atlases]
+    for entry, (atlas, x, y), image in zip(entries, places, images):
+        painters[atlas].drawImage(x, y, image)
+        entry.update(atlas=atlas, rect=[x, y, image.width(), image.height()])
+    for painter in painters:
+        painter.end()
+
+    os.makedirs(output_dir, exist_ok=True)
+    atlas_names = []
+    for i, atlas_image in enumerate(atlases):
+        atlas_names.append('atlas_{}.png'.format(i))
+        if not atlas_image.save(os.path.join(output_dir, atlas_names[-1])):
+            raise IOError("Can't save atlas '{}'".format(atlas_names[-1]))
+    manifest_path = os.path.join(output_dir, os.path.basename(ATLAS_MANIFEST_PATH))
+    with open(manifest_path, 'w') as file:
+        json.dump({'version': ATLAS_MANIFEST_VERSION, 'atlases': atlas_names, 'groups': groups}, file, indent=1)
+    logger.info("Packed {} sprites into {} atlases".format(len(images), len(atlases)))
+    return manifest_path
+
+
+def check_atlas(manifest_path: str) -> List[str]:
+    """
+    Compare sprite directories w/ manifest by content of files
+    :param manifest_path: manifest written by build_atlas
+    :return: list of paths of files, that were added, removed or changed after build
+    """
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+    if manifest['version'] != ATLAS_MANIFEST_VERSION:
+        raise ValueError("Unsupported version of manifest {}".format(manifest['version']))
+    stale = []
+    for group, dir_paths in ATLAS_GROUPS.items():
+        sources = manifest['groups'].get(group, {})
+        for dir_path in dir_paths:
+            files = sources.get(dir_path, {})
+            listed = dict(list_sprite_files(dir_path))
+            for filename in sorted(set(listed) | set(files)):
+                if filename not in listed or filename not in files or \
+                        get_file_digest(listed[filename]) != files[filename]['sha1']:
+                    stale.append(os.path.join(dir_path, filename))
+    return stale
+
+
+def main(argv: List[str]) -> int:
+    parser = ArgumentParser(description="Pack sprites of the map editor into atlases")
+    parser.add_argument('-o', '--output', default=None,
+                        help="directory of atlases and manifest (default: one, which the editor reads)")
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE, help="max side of atlas, pixels")
+    parser.add_argument('--check', action='store_true',
+                        help="don't build, exit w/ 1 if atlas doesn't match content of sprite files")
+    args = parser.parse_args(argv)
+    init_logger()
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(EDITOR_DIR)
+    if output is None:
+        output = os.path.dirname(ATLAS_MANIFEST_PATH)
+    try:
+        if args.check:
+            stale = check_atlas(os.path.join(output, os.path.basename(ATLAS_MANIFEST_PATH)))
+            for file_path in stale:
+                logger.error("Atlas is stale: '{}' was added, removed or changed, rebuild it".format(file_path))
+            return 1 if stale else 0
+        print(build_atlas(output, args.max_size))
+    except (ValueError, KeyError, TypeError, IOError) as e:
+        logger.error(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,9 +1,42 @@
 # -*- coding: utf-8 -*-
+import copy
+import sys
+
+_ATOMIC_TYPES = (str, int, float, bool, type(None))
+
 
 class BaseEditorClass:
+    # slotted w/o __dict__: maps may have tens of thousands of objects, which are deep-copied on each save of undo
+    __slots__ = ('kind', 'rotation')
+
     def __init__(self, init_info):
-        self.kind = init_info['kind']
+        # kinds repeat a lot, so all objects share one string per kind
+        self.kind = sys.intern(init_info['kind'])
         self.rotation = init_info['rotate']
 
     def __iter__(self):
         raise NotImplementedError("Subclasses should implement __iter__")
+
+    def __deepcopy__(self, memo):
+        # default deepcopy of slotted objects goes through __reduce_ex__ and is slower than copy of __dict__
+        obj = object.__new__(type(self))
+        memo[id(self)] = obj
+        for name in _get_slots(type(self)):
+            value = getattr(self, name)
+            object.__setattr__(obj, name, value if type(value) in _ATOMIC_TYPES else copy.deepcopy(value, memo))
+        return obj
+
+
+_SLOTS = {}
+
+
+def _get_slots(cls) -> tuple:
+    """
+    Get names of slots of class and its bases
+    :return: tuple
+    """
+    slots = _SLOTS.get(cls)
+    if slots is None:
+        slots = _SLOTS[cls] = tuple(name for klass in reversed(cls.__mro__)
+                                    for name in klass.__dict__.get('__slots__', ()))
+    return slots
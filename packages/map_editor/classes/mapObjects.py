@@ -3,6 +3,8 @@ from .baseClass import BaseEditorClass
 
 
 class MapBaseObject(BaseEditorClass):
+    __slots__ = ('position', 'height', 'optional', 'static')
+
     def __init__(self, init_info):
         BaseEditorClass.__init__(self, init_info)
         self.position = list(init_info['pos'])
@@ -31,6 +33,7 @@ class MapBaseObject(BaseEditorClass):
 
 
 class SignObject(MapBaseObject):
+    __slots__ = ('tag_id',)
 
     def __init__(self, init_info):
         MapBaseObject.__init__(self, init_info)
@@ -56,12 +59,14 @@ class SignObject(MapBaseObject):
     
 
 class CityObject(MapBaseObject):
+    __slots__ = ()
 
     def __init__(self, init_info):
         MapBaseObject.__init__(self, init_info)
 
 
 class WatchTowerObject(MapBaseObject):
+    __slots__ = ('hostname',)
 
     def __init__(self, init_info):
         MapBaseObject.__init__(self, init_info)
@@ -88,6 +93,7 @@ class WatchTowerObject(MapBaseObject):
 
 
 class GroundAprilTagObject(MapBaseObject):
+    __slots__ = ('tag_id', 'tag_type')
 
     def __init__(self, init_info):
         MapBaseObject.__init__(self, init_info)
@@ -4,6 +4,7 @@ from .baseClass import BaseEditorClass
 
 
 class MapTile(BaseEditorClass):
+    __slots__ = ()
     rotation_val = {0: 'E', 90: 'S', 180: 'W', 270: 'N'}
     no_rotation_tile = ('empty', 'asphalt', 'grass', 'floor', '4way')
 
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Dict, Optional, Tuple
+
+from undo_stack import AttributesChange, copy_value
+
+
+class ChangeJournal:
+    """
+    Journal of edit of dt-world map. Edit reports attributes before changing them (watch or set),
+    journal keeps their old values, and commit compares them with current ones.
+    So only touched frames, tiles, groups and objects are visited, the map is never copied
+    """
+
+    def __init__(self):
+        self._watched: Dict[Tuple[int, str], Tuple[Any, str, Any]] = {}  # (id(obj), name) -> (obj, name, old value)
+
+    def __bool__(self):
+        return bool(self._watched)
+
+    def watch(self, obj, *names: str):
+        """
+        Remember values of attributes, which edit is going to change; the first value is kept for each attribute
+        :param obj: frame pose, tile, group or object of dt-world map
+        :param names: names of attributes
+        :return: -
+        """
+        for name in names:
+            key = (id(obj), name)
+            if key not in self._watched:
+                self._watched[key] = (obj, name, copy_value(getattr(obj, name, None)))
+
+    def set(self, obj, name: str, value):
+        """
+        Change attribute w/ journaling
+        :return: -
+        """
+        self.watch(obj, name)
+        setattr(obj, name, value)
+
+    def commit(self) -> Optional[AttributesChange]:
+        """
+        Finish edit, journal is empty after commit
+        :return: AttributesChange w/ modified attributes, None if nothing was modified
+        """
+        changes = []
+        for obj, name, old in self._watched.values():
+            new = getattr(obj, name, None)
+            if new != old:
+                changes.append((obj, name, old, copy_value(new)))
+        self._watched.clear()
+        return AttributesChange(changes) if changes else None
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import weakref
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import logging
+
+from spatial_index import SpatialGrid
+
+logger = logging.getLogger('root')
+
+
+class FramePoseCache:
+    """
+    Cache of world poses (x, y, yaw) for all frames of duckietown_world map.
+    Frames form a tree by `relative_to`, world pose of frame is pose of parent composed with local pose (SE(2)).
+    Poses are resolved level by level of the tree, each level is one vectorized NumPy operation.
+    After changing of frames (mark_dirty) only subtrees of changed frames are recomputed.
+    World positions are also kept in spatial index (keys are indexes of frames), that is updated incrementally
+    """
+
+    def __init__(self, dm):
+        self._dm = weakref.ref(dm)  # cache mustn't keep its map alive
+        self.keys: List[Tuple] = []  # keys of dm.frames: (name, type)
+        self.index: Dict[str, int] = {}
+        self._pose_index: Dict[int, int] = {}  # id of pose -> index of frame
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.local = np.zeros((0, 3))
+        self.world = np.zeros((0, 3))
+        self.spatial = SpatialGrid()
+        self._frames = []
+        self._children: List[List[int]] = []
+        self._levels: List[np.ndarray] = []
+        self._depth = np.zeros(0, dtype=np.int64)
+        self._dirty = set()
+        self._need_rebuild = True
+
+    @property
+    def dm(self):
+        return self._dm()
+
+    def __len__(self):
+        self.update()
+        return len(self.keys)
+
+    def invalidate(self):
+        """
+        Rebuild the tree on next access (frames were added/removed or reparented)
+        :return: -
+        """
+        self._need_rebuild = True
+
+    def mark_dirty(self, names: Iterable[str]):
+        """
+        Mark frames with changed local pose
+        :param names: names of frames
+        :return: -
+        """
+        for name in names:
+            if name in self.index:
+                self._dirty.add(self.index[name])
+            else:
+                self._need_rebuild = True
+
+    def mark_poses_dirty(self, poses: Iterable):
+        """
+        Mark frames by their changed poses, e.g. poses restored by undo
+        :param poses: pose objects of frames
+        :return: -
+        """
+        for pose in poses:
+            idx = self._pose_index.get(id(pose))
+            if idx is not None and self._frames[idx].pose is pose:
+                self._dirty.add(idx)
+            else:
+                self._need_rebuild = True
+
+    def update(self) -> np.ndarray:
+        """
+        Recompute world poses of changed subtrees
+        :return: indexes of frames, which world pose was recomputed
+        """
+        if self._need_rebuild:
+            self._build()
+            return np.arange(len(self.keys))
+        if not self._dirty:
+            return np.zeros(0, dtype=np.int64)
+        dirty = np.fromiter(self._dirty, dtype=np.int64)
+        self._dirty.clear()
+        self._read_local(dirty)
+        affected = np.zeros(len(self.keys), dtype=bool)
+        stack = list(dirty)
+        while stack:
+            idx = stack.pop()
+            if not affected[idx]:
+                affected[idx] = True
+                stack.extend(self._children[idx])
+        self._resolve(affected, int(self._depth[dirty].min()))
+        changed = np.flatnonzero(affected)
+        for idx in changed:
+            self.spatial.move(idx, self.world[idx, 0], self.world[idx, 1])
+        return changed
+
+    def get(self, name: str) -> np.ndarray:
+        """
+        Get world pose of frame
+        :param name: name of frame
+        :return: array (x, y, yaw)
+        :raises KeyError: if frame doesn't exist
+        """
+        self.update()
+        if name not in self.index:
+            # frame was added without invalidation
+            self.invalidate()
+            self.update()
+            if name not in self.index:
+                raise KeyError(name)
+        return self.world[self.index[name]]
+
+    def get_frame(self, idx: int):
+        return self._frames[idx]
+
+    def nearest(self, x: float, y: float, radius: float) -> Optional[int]:
+        """
+        Find the nearest frame to world point within radius
+        :return: index of frame or None
+        """
+        self.update()
+        return self.spatial.nearest(x, y, radius)
+
+    def to_local(self, name: str, x: float, y: float) -> Tuple[float, float]:
+        """
+        Convert world point to coordinates, in which local pose of frame is defined (frame of parent)
+        :param name: name of frame
+        :param x: world x
+        :param y: world y
+        :return: (x, y) relative to parent of frame
+        """
+        self.update()
+        parent = self.parent[self.index[name]]
+        if parent < 0:
+            return x, y
+        origin_x, origin_y, origin_yaw = self.world[parent]
+        dx, dy = x - origin_x, y - origin_y
+        cos, sin = np.cos(origin_yaw), np.sin(origin_yaw)
+        return float(cos * dx + sin * dy), float(-sin * dx + cos * dy)
+
+    def _build(self):
+        self._need_rebuild = False
+        self._dirty.clear()
+        self.keys, self._frames = [], []
+        for key, frame in self.dm.frames:
+            self.keys.append(key)
+            self._frames.append(frame)
+        self.index = {name: idx for idx, (name, _) in enumerate(self.keys)}
+        self._pose_index = {id(frame.pose): idx for idx, frame in enumerate(self._frames)}
+        count = len(self.keys)
+        self.parent = np.array([self.index.get(frame.relative_to, -1) for frame in self._frames], dtype=np.int64)
+        self._children = [[] for _ in range(count)]
+        for idx, parent in enumerate(self.parent):
+            if parent >= 0:
+                self._children[parent].append(idx)
+        self._depth = np.full(count, -1, dtype=np.int64)
+        for idx in range(count):
+            self._compute_depth(idx)
+        levels = defaultdict(list)
+        for idx, depth in enumerate(self._depth):
+            levels[depth].append(idx)
+        self._levels = [np.array(levels[depth], dtype=np.int64) for depth in range(len(levels))]
+        self.local = np.zeros((count, 3))
+        self.world = np.zeros((count, 3))
+        self._read_local(np.arange(count))
+        self._resolve(np.ones(count, dtype=bool), 0)
+        self.spatial.build((idx, x, y) for idx, (x, y) in enumerate(self.world[:, :2].tolist()))
+        logger.debug("Frame tree is rebuilt: {} frames, {} levels".format(count, len(self._levels)))
+
+    def _compute_depth(self, idx: int):
+        path, visited = [], set()
+        while idx >= 0 and self._depth[idx] < 0:
+            if idx in visited:
+                # cycle in relative_to, break it at this frame and resolve path again
+                logger.warning("Cycle of frames at '{}'".format(self.keys[idx][0]))
+                self._children[self.parent[idx]].remove(idx)
+                self.parent[idx] = -1
+                for node in path:
+                    self._compute_depth(node)
+                return
+            path.append(idx)
+            visited.add(idx)
+            idx = self.parent[idx]
+        for node in reversed(path):
+            parent = self.parent[node]
+            self._depth[node] = self._depth[parent] + 1 if parent >= 0 else 0
+
+    def _read_local(self, indexes: np.ndarray):
+        for idx in indexes:
+            pose = self._frames[idx].pose
+            self.local[idx] = (pose.x, pose.y, pose.yaw)
+
+    def _resolve(self, mask: np.ndarray, start_depth: int):
+        for level in self._levels[start_depth:]:
+            idx = level[mask[level]]
+            if not len(idx):
+                continue
+            parent = self.parent[idx]
+            local = self.local[idx]
+            is_root = parent < 0
+            origin = np.where(is_root[:, None], 0., self.world[parent])
+            cos, sin = np.cos(origin[:, 2]), np.sin(origin[:, 2])
+            self.world[idx, 0] = origin[:, 0] + cos * local[:, 0] - sin * local[:, 1]
+            self.world[idx, 1] = origin[:, 1] + sin * local[:, 0] + cos * local[:, 1]
+            self.world[idx, 2] = origin[:, 2] + local[:, 2]
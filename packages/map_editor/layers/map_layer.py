@@ -4,17 +4,55 @@ from layers.relations import LAYER_TYPE_WITH_OBJECTS
 
 
 import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
 logger = logging.getLogger('root')
 
 
 class MapLayer:
+    """
+    Layer of map. Objects of object layers get stable ids: id -> position and object -> id are indexed,
+    so objects are found and removed w/o scanning of layer. Removed objects leave holes,
+    which are compacted in one pass on next access to data
+    """
+
     def __init__(self, layer_type: LayerType, layer_data: list, name=''):
         self.name = name
         self.type = layer_type
+        self._next_id = 0
+        self.revision = 0  # changed on adding and removing of objects
         self.data = layer_data
         self.visible = True
 
+    @property
+    def data(self) -> list:
+        if self._holes:
+            self._compact()
+        return self._data
+
+    @data.setter
+    def data(self, layer_data: list):
+        self._data = layer_data
+        self.revision += 1
+        self._ids: List[Optional[int]] = []
+        self._positions: Dict[int, int] = {}  # id -> position in data
+        self._id_of: Dict[int, int] = {}  # id() of object -> id
+        self._holes = 0
+        if self.type in LAYER_TYPE_WITH_OBJECTS:
+            self._index_objects(0)
+
+    def __getstate__(self):
+        # index of objects by identity isn't valid for copies
+        if self._holes:
+            self._compact()
+        state = self.__dict__.copy()
+        del state['_id_of']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._id_of = {id(layer_object): obj_id for layer_object, obj_id in zip(self._data, self._ids)}
+
     def __iter__(self):
         yield from {
             'type': str(self.type),
@@ -28,10 +66,34 @@ class MapLayer:
         :param elem: elem for adding or list of elements
         :return: -
         """
+        data = self.data
+        start = len(data)
         if type(elem) == list:
-            self.data.extend(elem)
+            data.extend(elem)
         else:
-            self.data.append(elem)
+            data.append(elem)
+        self.revision += 1
+        if self.type in LAYER_TYPE_WITH_OBJECTS:
+            self._index_objects(start)
+
+    def _index_objects(self, start: int):
+        for position in range(start, len(self._data)):
+            obj_id = self._next_id
+            self._next_id += 1
+            self._ids.append(obj_id)
+            self._positions[obj_id] = position
+            self._id_of[id(self._data[position])] = obj_id
+
+    def _compact(self):
+        data, ids = [], []
+        for layer_object, obj_id in zip(self._data, self._ids):
+            if obj_id is not None:
+                self._positions[obj_id] = len(data)
+                data.append(layer_object)
+                ids.append(obj_id)
+        self._data[:] = data
+        self._ids = ids
+        self._holes = 0
 
     def get_processed_layer_data(self):
         """
@@ -71,8 +133,87 @@ class MapLayer:
             for layer_object in self.data:
                 yield layer_object
 
+    def get_ids(self) -> List[int]:
+        """
+        Get ids of objects in order of data
+        :return: list
+        """
+        if self._holes:
+            self._compact()
+        return list(self._ids)
+
+    def get_id(self, layer_object) -> Optional[int]:
+        """
+        Get id of object
+        :param layer_object: object of layer (compared by identity)
+        :return: int, if object isn't in layer, return None
+        """
+        return self._id_of.get(id(layer_object))
+
+    def get_object(self, obj_id: int):
+        """
+        Get object by id
+        :param obj_id: id of object
+        :return: object, if id doesn't exist, return None
+        """
+        position = self._positions.get(obj_id)
+        return self._data[position] if position is not None else None
+
+    def remove_objects(self, obj_ids: Iterable[int]) -> int:
+        """
+        Remove objects by ids, unknown ids are skipped
+        :param obj_ids: ids of objects
+        :return: count of removed objects
+        """
+        removed = 0
+        for obj_id in obj_ids:
+            position = self._positions.pop(obj_id, None)
+            if position is None:
+                continue
+            del self._id_of[id(self._data[position])]
+            self._data[position] = self._ids[position] = None
+            removed += 1
+        self._holes += removed
+        self.revision += 1
+        return removed
+
+    def get_placed_objects(self, obj_ids: Iterable[int]) -> List[Tuple[int, int, object]]:
+        """
+        Get objects w/ their places, e.g. to put them back after removing
+        :param obj_ids: ids of objects, unknown ids are skipped
+        :return: list of (position, id, object)
+        """
+        data = self.data
+        positions = sorted(self._positions[obj_id] for obj_id in set(obj_ids) if obj_id in self._positions)
+        return [(position, self._ids[position], data[position]) for position in positions]
+
+    def insert_objects(self, items: Sequence[Tuple[int, int, object]]):
+        """
+        Put objects back w/ their ids
+        :param items: list of (position, id, object), positions are as returned by get_placed_objects
+        :return: -
+        """
+        if not items:
+            return
+        data = self.data
+        items = sorted(items, key=lambda item: item[0])
+        for position, obj_id, layer_object in items:
+            position = min(position, len(data))
+            data.insert(position, layer_object)
+            self._ids.insert(position, obj_id)
+            self._id_of[id(layer_object)] = obj_id
+        for position in range(min(items[0][0], len(data) - 1), len(data)):
+            self._positions[self._ids[position]] = position
+        self.revision += 1
+
+    def remove_object(self, obj_id: int) -> bool:
+        return self.remove_objects((obj_id,)) == 1
+
     def remove_object_from_layer(self, layer_object):
-        self.data.remove(layer_object)
+        obj_id = self.get_id(layer_object)
+        if obj_id is None:
+            raise ValueError("Object isn't in layer")
+        self.remove_object(obj_id)
 
     @staticmethod
     def create_layer_object(object_type, object_data):
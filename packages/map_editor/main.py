@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import time
+
+START_TIME = time.perf_counter()
+
 import sys
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import QTranslator
@@ -26,6 +30,8 @@ def main(app_args):
 
     # Create main window
     window = duck_window(args)
+    window.mapviewer.firstFrameDrawn.connect(
+        lambda: logger.info("Time to first frame: {:.3f} s".format(time.perf_counter() - START_TIME)))
 
     window.show()
     app.exec_()
@@ -36,6 +42,8 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-d', '--debug', action="store_true", help="Debug mode")
     parser.add_argument('-l', '--locale', choices=available_locales, default='en', help="App locale")
+    parser.add_argument('--profile-render', action="store_true",
+                        help="Show overlay with frame time and paint time of map layers")
 
     args = parser.parse_args()
     args.locale_path = available_locales[args.locale]
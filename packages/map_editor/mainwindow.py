@@ -20,6 +20,7 @@ import mapviewer
 import utils
 from DTWorld import get_dt_world
 from DTWorld import get_new_dt_world
+from DTWorld import get_pose_cache, drop_pose_cache
 from IOManager import *
 import logging
 from classes.mapObjects import GroundAprilTagObject
@@ -38,16 +39,21 @@ from layers.relations import get_layer_type_by_object_type
 from main_design import *
 from managerduckietownmaps import ManagerDuckietownMaps
 from mapEditor import MapEditor
+from selection_model import SelectionModel
 from tag_config import get_duckietown_types
+from undo_stack import UndoCommand
 
 logger = logging.getLogger('root')
 TILE_TYPES = ('block', 'road')
 DEFAULT_TILE_SIZE = 0.585
+CAMERA_FORM_KEYS = ("width", "height", "framerate", "distortion_parameters", "camera_matrix")  # edited on camera
 
 # pyuic5 main_design.ui -o main_design.py
 
 _translate = QtCore.QCoreApplication.translate
 EPS = .1  # step for move
+NUDGES = {QtCore.Qt.Key_W: (0, -EPS), QtCore.Qt.Key_S: (0, EPS),
+          QtCore.Qt.Key_A: (-EPS, 0), QtCore.Qt.Key_D: (EPS, 0)}  # moves of selected objects by keys
 
 # rot_val = {'E': 0, 'S': 90, 'W': 180, 'N': 270, None: 0}
 rot_val = {'E': 0, 'S': 270, 'W': 180, 'N': 90, None: 0}
@@ -73,9 +79,11 @@ class duck_window(QtWidgets.QMainWindow):
         # active items in editor
         self.distortion_view_one_string_mode = True
         self.region_create = False
-        self.active_items = []
+        self.active_items = SelectionModel()
         self.active_group = None
         self.name_of_editable_obj = None
+        # nudges while these keys are held are one step of undo history
+        self.held_nudge_keys = set()
         self.dm = get_dt_world()
         self.tile_size = DEFAULT_TILE_SIZE
         self.duckie_manager = ManagerDuckietownMaps()
@@ -111,9 +119,11 @@ class duck_window(QtWidgets.QMainWindow):
         self.dm = get_dt_world(map_name)
         logger.debug(self.dm.get_context())
         self.map = map.DuckietownMap()
+        self.map.compact_tile_layer()
+        self.active_items.set_map(self.map)
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
-        viewer = mapviewer.MapViewer()
+        viewer = mapviewer.MapViewer(args.profile_render)
         self.editor = MapEditor(self.map, self.mapviewer)
         viewer.setMap(self.map)
         self.mapviewer = viewer
@@ -121,6 +131,11 @@ class duck_window(QtWidgets.QMainWindow):
         self.ui.horizontalLayout.addWidget(viewer)
         viewer.repaint()
         self.initUi()
+        # size of undo history in status bar
+        self.history_label = QtWidgets.QLabel()
+        self.statusBar().addPermanentWidget(self.history_label)
+        self.editor.history.changed = self.update_history_status
+        self.update_history_status()
 
         self.update_layer_tree()
 
@@ -168,6 +183,7 @@ class duck_window(QtWidgets.QMainWindow):
         #  Signal from viewer
         self.mapviewer.selectionChanged.connect(self.selectionUpdate)
         self.mapviewer.editObjectChanged.connect(self.create_form)
+        self.mapviewer.dragFinished.connect(self.editor.commit_journal)
         self.new_tag_class.apriltag_added.connect(self.add_apriltag)
 
         #  Assign actions to buttons
@@ -207,11 +223,14 @@ class duck_window(QtWidgets.QMainWindow):
         b3 = QtWidgets.QAction(QtGui.QIcon("img/icons/insert.png"), _translate("MainWindow", "Paste"), self)
         b4 = QtWidgets.QAction(QtGui.QIcon("img/icons/delete.png"), _translate("MainWindow", "Delete"), self)
         b5 = QtWidgets.QAction(QtGui.QIcon("img/icons/undo.png"), _translate("MainWindow", "Undo"), self)
+        redo_icon = QtGui.QPixmap("img/icons/undo.png").transformed(QtGui.QTransform().scale(-1, 1))
+        b6 = QtWidgets.QAction(QtGui.QIcon(redo_icon), _translate("MainWindow", "Redo"), self)
         b1.setShortcut("Ctrl+C")
         b2.setShortcut("Ctrl+X")
         b3.setShortcut("Ctrl+V")
         b4.setShortcut("Delete")
         b5.setShortcut("Ctrl+Z")
+        b6.setShortcut("Ctrl+Shift+Z")
 
         c1 = QtWidgets.QAction(QtGui.QIcon("img/icons/rotate.png"), _translate("MainWindow", "Rotate"), self)
         c2 = QtWidgets.QAction(QtGui.QIcon("img/icons/trim.png"),
@@ -234,13 +253,15 @@ class duck_window(QtWidgets.QMainWindow):
         b3.triggered.connect(self.insert_button_clicked)
         b4.triggered.connect(self.delete_button_clicked)
         b5.triggered.connect(self.undo_button_clicked)
+        b6.triggered.connect(self.redo_button_clicked)
+        self.undo_action, self.redo_action = b5, b6
 
         c1.triggered.connect(self.rotateSelectedTiles)
         c2.triggered.connect(self.trimClicked)
 
         self.brush_button.clicked.connect(self.brush_mode)
 
-        for elem in [[a1, a2, a3, a4, a5], [b1, b2, b3, b4, b5]]:
+        for elem in [[a1, a2, a3, a4, a5], [b1, b2, b3, b4, b5, b6]]:
             for act in elem:
                 tool_bar.addAction(act)
             tool_bar.addSeparator()
@@ -338,7 +359,6 @@ class duck_window(QtWidgets.QMainWindow):
     #  Open map
     def create_map_triggered(self):
         logger.debug(2)
-        self.editor.save(self.map)
 
         def init_info(info):
             i, j = int(info['x']), int(info['y'])
@@ -383,11 +403,13 @@ class duck_window(QtWidgets.QMainWindow):
     #  Calculate map characteristics
     def calc_param_triggered(self):
         text = ""
-        for info, obj in self.dm.tiles:
+        poses = get_pose_cache(self.dm)
+        for (name, _), obj in self.dm.tiles:
             i, j = obj.i, obj.j
             type = obj.type
             orientation = obj.type
-            text += f"{i}-{j}: {type}/{orientation}\n"
+            x, y, yaw = poses.get(name)
+            text += f"{i}-{j}: {type}/{orientation} ({x:.3f}, {y:.3f}, {np.rad2deg(yaw):.0f}°)\n"
         self.show_info(self.param_window, _translate("MainWindow", "Map characteristics"), text)
 
     #  Help: About
@@ -556,6 +578,8 @@ class duck_window(QtWidgets.QMainWindow):
         event.accept()
 
     def create_empty_map(self, i_size: int, j_size: int) -> None:
+        # new tiles replace tiles of dm, which history refers to
+        self.editor.history.clear()
         self.mapviewer.i_tile, self.mapviewer.j_tile = i_size, j_size
         for i in range(i_size):
             for j in range(j_size):
@@ -568,6 +592,8 @@ class duck_window(QtWidgets.QMainWindow):
                 tile.frame.relative_to = self.dm.get_context()
                 tile.frame.dm = self.dm
                 self.dm.add(tile)
+        self.mapviewer.frames_changed()
+        self.mapviewer.invalidate_tiles()
 
     #  Handle a click on an item from a list to a list
     def item_list_clicked(self):
@@ -619,8 +645,6 @@ class duck_window(QtWidgets.QMainWindow):
                 self.ui.default_fill.setCurrentText(self.get_translation(self.info_json['info'][item_name])['name'])
                 logger.debug("Set {} for brush".format(item_name))
             else:
-                # save map before adding object
-                self.editor.save(self.map)
                 # adding object
                 print(item_name)
                 type_of_element = self.info_json['info'][item_name]['type']
@@ -646,6 +670,7 @@ class duck_window(QtWidgets.QMainWindow):
                 if obj:
                     obj.frame.relative_to = self.dm.get_context()
                     self.dm.add(obj)
+                    self.mapviewer.frames_changed()
 
                 # TODO: need to understand what's the type and create desired class, not general
                 # also https://github.com/moevm/mse_visual_map_editor_for_duckietown/issues/122
@@ -681,7 +706,6 @@ class duck_window(QtWidgets.QMainWindow):
     def insert_button_clicked(self):
         if len(self.copyBuffer) == 0:
             return
-        self.editor.save(self.map)
         if self.drawState == 'copy':
             self.editor.copySelection(self.copyBuffer, self.mapviewer.tileSelection[0], self.mapviewer.tileSelection[1],
                                       MapTile(self.ui.delete_fill.currentData()))
@@ -701,7 +725,28 @@ class duck_window(QtWidgets.QMainWindow):
 
     #  Undo
     def undo_button_clicked(self):
-        self.editor.undo()
+        command = self.editor.undo()
+        if command is not None:
+            self.history_changed(command)
+
+    #  Redo
+    def redo_button_clicked(self):
+        command = self.editor.redo()
+        if command is not None:
+            self.history_changed(command)
+
+    def update_history_status(self):
+        history = self.editor.history
+        self.history_label.setText(_translate("MainWindow", "History: {} steps, {:.1f} MB in memory, {:.1f} MB on disk")
+                                   .format(len(history), history.memory_size / 2 ** 20, history.disk_size / 2 ** 20))
+        self.undo_action.setEnabled(history.can_undo())
+        self.redo_action.setEnabled(history.can_redo())
+
+    def history_changed(self, command: UndoCommand):
+        # only attributes, which command changed, are refreshed
+        changed = command.changed()
+        self.active_items.objects_moved([obj for obj, name in changed if name == 'position'])
+        self.mapviewer.attributes_changed(changed)
         self.mapviewer.scene().update()
         self.update_layer_tree()
 
@@ -713,29 +758,18 @@ class duck_window(QtWidgets.QMainWindow):
             self.drawState = ''
 
     def keyPressEvent(self, e):
-        selection = self.mapviewer.raw_selection
-        item_layer = self.map.get_objects_from_layers()  # TODO: add self.current_layer for editing only it's objects?
-        new_selected_obj = False
-        for layer in self.dm:
-            print(layer)
-        print(selection)
         if self.region_create:
             self.region_create = False
 
-        for item in item_layer:
-            x, y = item.position
-            if x > selection[0] and x < selection[2] and y > selection[1] and y < selection[3]:
-                if item not in self.active_items:
-                    self.active_items.append(item)
-                    new_selected_obj = True
-        if new_selected_obj:
-            # save map if new objects are selected
-            self.editor.save(self.map)
+        # TODO: add self.current_layer for editing only it's objects?
+        self.active_items.select_rect(self.mapviewer.raw_selection)
         key = e.key()
         print('KEY ', key,  " ", QtCore.Qt.ALT, " ", e.modifiers())
+        if key not in NUDGES:
+            self.finish_nudges()
         if key == QtCore.Qt.Key_Q:
             # clear object buffer
-            self.active_items = []
+            self.active_items.clear()
             self.mapviewer.raw_selection = [0] * 4
         elif key == QtCore.Qt.Key_R:
             self.new_tag_class.create_form()
@@ -749,33 +783,46 @@ class duck_window(QtWidgets.QMainWindow):
             if key == QtCore.Qt.Key_Backspace:
                 # delete object
                 if question_form_yes_no(self, "Deleting objects", "Delete objects from map?") == QMessageBox.Yes:
-                    # save map before deleting objects
-                    self.editor.save(self.map)
-                    for item in self.active_items:
+                    ids_by_layer = {}
+                    for item in self.active_items.get_items():
                         object_type = self.info_json['info'][item.kind]['type']
                         layer = self.map.get_layer_by_type(get_layer_type_by_object_type(object_type))
-                        layer.remove_object_from_layer(item)
-                    self.active_items = []
+                        ids_by_layer.setdefault(layer, []).append(layer.get_id(item))
+                    with self.editor.history.macro():
+                        for layer, ids in ids_by_layer.items():
+                            self.editor.remove_objects(layer, ids)
+                    self.active_items.clear()
                     self.mapviewer.scene().update()
                     self.update_layer_tree()
                 return
-            for item in self.active_items:
-                logger.debug("Name of item: {}; X - {}; Y - {};".format(item.kind, item.position[0], item.position[1]))
-                if key == QtCore.Qt.Key_W:
-                    item.position[1] -= EPS
-                elif key == QtCore.Qt.Key_S:
-                    item.position[1] += EPS
-                elif key == QtCore.Qt.Key_A:
-                    item.position[0] -= EPS
-                elif key == QtCore.Qt.Key_D:
-                    item.position[0] += EPS
-                elif key == QtCore.Qt.Key_E:
-                    if len(self.active_items) == 1:
-                        self.create_form(self.active_items[0])
-                    else:
-                        logger.debug("I can't edit more than one object!")
+            if key in NUDGES:
+                if not self.held_nudge_keys:
+                    self.editor.begin_transaction()
+                self.held_nudge_keys.add(key)
+                self.active_items.move_selected(*NUDGES[key])
+                self.editor.move_objects(self.active_items.get_items(), *NUDGES[key])
+            elif key == QtCore.Qt.Key_E:
+                if len(self.active_items) == 1:
+                    self.create_form(self.active_items.get_items()[0])
+                else:
+                    logger.debug("I can't edit more than one object!")
         self.mapviewer.scene().update()
 
+    def keyReleaseEvent(self, e):
+        if not e.isAutoRepeat() and e.key() in self.held_nudge_keys:
+            self.held_nudge_keys.discard(e.key())
+            if not self.held_nudge_keys:
+                self.editor.commit()
+
+    def finish_nudges(self):
+        """
+        End burst of nudges, e.g. if release of key was missed
+        :return: -
+        """
+        if self.held_nudge_keys:
+            self.held_nudge_keys.clear()
+            self.editor.commit()
+
     def create_form(self, active_object_data: tuple):
 
         active_object, (name, tp) = active_object_data
@@ -783,16 +830,17 @@ class duck_window(QtWidgets.QMainWindow):
         self.name_of_editable_obj = name
         assert tp is _Frame
 
-        def accept():
+        def apply_form():
             active_object.pose.x = float(edit_obj['x'].text())
             active_object.pose.y = float(edit_obj['y'].text())
             active_object.pose.yaw = float(np.deg2rad(float(edit_obj['yaw'].text())))
+            self.mapviewer.frames_changed([name])
             new_type = None
             print(f"ACCEPT: {cam_obj}")
             for key in editable_values:
                 try:
                     print("Key - ", key)
-                    if key in ["width", "height", "framerate", "distortion_parameters", "camera_matrix"]:  # cam obj
+                    if key in CAMERA_FORM_KEYS:  # cam obj
                         if key in ["width", "height", "framerate"]:
                             cam_obj[key] = int(edit_obj[key].text().split()[0])
                         elif key == "distortion_parameters":
@@ -849,6 +897,15 @@ class duck_window(QtWidgets.QMainWindow):
                         obj[key] = new_value
                 except Exception as e:
                     print(e)
+
+        def accept():
+            with self.editor.dt_edit() as journal:
+                journal.watch(active_object.pose, 'x', 'y', 'yaw')
+                # only attributes of the form are written
+                journal.watch(obj, *(key for key in editable_values if key not in CAMERA_FORM_KEYS))
+                if cam_obj is not None:
+                    journal.watch(cam_obj, *(key for key in editable_values if key in CAMERA_FORM_KEYS))
+                apply_form()
             dialog.close()
             self.mapviewer.scene().update()
             self.update_layer_tree()
@@ -1026,11 +1083,15 @@ class duck_window(QtWidgets.QMainWindow):
         print(self.name_of_editable_obj)
         members = self.active_group.members
         if self.name_of_editable_obj not in members:
-            members.append(self.name_of_editable_obj)
+            with self.editor.dt_edit() as journal:
+                journal.watch(self.active_group, 'members')
+                members.append(self.name_of_editable_obj)
 
     def del_group_triggered(self):
         if self.name_of_editable_obj in self.active_group.members:
-            self.active_group.members.remove(self.name_of_editable_obj)
+            with self.editor.dt_edit() as journal:
+                journal.watch(self.active_group, 'members')
+                self.active_group.members.remove(self.name_of_editable_obj)
 
     def change_active_group(self, value: str):
         print(value)
@@ -1038,48 +1099,64 @@ class duck_window(QtWidgets.QMainWindow):
         self.active_group = self.dm.get_object(value.split()[0], _Group)
 
     def rotateSelectedTiles(self):
-        self.editor.save(self.map)
         is_selected_tile = self.mapviewer.is_selected_tile
-        for ((nm, _), tile) in self.dm.tiles:
-            if is_selected_tile(tile):
-                frame: _Frame = self.dm.frames[nm]
-                orien_val = get_degree_for_orientation(tile.orientation) - 90  # (rot_val[tile.orientation] + 90) % 360
-                tile.orientation = get_orientation_for_degree(orien_val)
-                frame.pose.yaw = {'E': np.pi * 1.5, 'N': 0, 'W': np.pi, 'S': np.pi * 0.5, None: 0}[tile.orientation]
+        changed_tiles, changed_frames = [], []
+        with self.editor.dt_edit() as journal:
+            for ((nm, _), tile) in self.dm.tiles:
+                if is_selected_tile(tile):
+                    frame: _Frame = self.dm.frames[nm]
+                    orien_val = get_degree_for_orientation(tile.orientation) - 90  # (rot_val[tile.orientation] + 90) % 360
+                    orientation = get_orientation_for_degree(orien_val)
+                    yaw = {'E': np.pi * 1.5, 'N': 0, 'W': np.pi, 'S': np.pi * 0.5, None: 0}[orientation]
+                    journal.set(tile, 'orientation', orientation)
+                    journal.set(frame.pose, 'yaw', yaw)
+                    changed_tiles.append((tile.i, tile.j))
+                    changed_frames.append(nm)
+        self.mapviewer.frames_changed(changed_frames)
+        self.mapviewer.invalidate_tiles(changed_tiles)
         self.mapviewer.scene().update()
 
     def add_apriltag(self, apriltag: GroundAprilTagObject):
         layer = self.map.get_layer_by_type(LayerType.GROUND_APRILTAG)
         if layer is None:
-            self.map.add_layer_from_data(LayerType.GROUND_APRILTAG, [apriltag])
-        else:
-            self.map.add_elem_to_layer_by_type(LayerType.GROUND_APRILTAG, apriltag)
+            self.map.add_layer_from_data(LayerType.GROUND_APRILTAG, [])
+            layer = self.map.get_layer_by_type(LayerType.GROUND_APRILTAG)
+        self.editor.add_objects(layer, [apriltag])
         self.update_layer_tree()
         self.mapviewer.scene().update()
 
     def trimClicked(self):
-        self.editor.save(self.map)
         self.editor.trimBorders(True, True, True, True, MapTile(self.ui.delete_fill.currentData()))
+        self.mapviewer.invalidate_tiles()
         self.mapviewer.scene().update()
         self.update_layer_tree()
 
     def selectionUpdate(self):
         is_selected_tile = self.mapviewer.is_selected_tile
         if self.drawState == 'brush':
-            self.editor.save(self.map)  # TODO: CTRL+Z need to fix because dt-world
-            tiles = self.dm.tiles.only_tiles()
-            for i in range(len(tiles)):
-                for j in range(len(tiles[0])):
-                    tile = tiles[i][j]
-                    if is_selected_tile(tile):
-                        tile.type = self.ui.default_fill.currentData()
-                        tile.orientation = 'E'
+            tiles = self.mapviewer.get_tile_grid()
+            changed_tiles = []
+            tile_type = self.ui.default_fill.currentData()
+            with self.editor.dt_edit() as journal:
+                for i in range(self.mapviewer.grid_width):
+                    for j in range(self.mapviewer.grid_height):
+                        tile = tiles[i][j]
+                        if is_selected_tile(tile):
+                            journal.set(tile, 'type', tile_type)
+                            journal.set(tile, 'orientation', 'E')
+                            changed_tiles.append((i, j))
+            self.mapviewer.invalidate_tiles(changed_tiles)
         self.update_layer_tree()
         self.mapviewer.scene().update()
 
     def reset_duckietown_map(self, new_dm: DuckietownMap):
+        # history refers to objects of previous map
+        self.editor.history.clear()
+        if self.dm is not new_dm:
+            drop_pose_cache(self.dm)
         self.dm = new_dm
         self.mapviewer.dm = new_dm
+        self.mapviewer.invalidate_tiles()
         # self.update_layer_tree()
         self.mapviewer.scene().update()
 
@@ -3,7 +3,9 @@ from layers.map_layer import MapLayer
 from layers.layer_type import LayerType
 import layers.relations as layer_relations
 from tag_config import TRAFFIC_SIGN_TYPES
+from tile_grid import TileGrid
 import logging
+from typing import Dict, List, Optional
 
 logger = logging.getLogger('root')
 
@@ -13,8 +15,32 @@ class DuckietownMap:
     gridSize = 58.5
 
     def __init__(self, empty=False):
+        self._layers_by_type: Dict[LayerType, MapLayer] = {}
+        self._layers_by_name: Dict[str, MapLayer] = {}
         self.layers = [MapLayer(LayerType.TILES, [[]]), MapLayer(LayerType.ITEMS, [])] if not empty else []
 
+    @property
+    def layers(self) -> List[MapLayer]:
+        """
+        Layers of map. Don't change list in place, use add_layer/set_layer/clear_objects_layers or assign new list,
+        so indexes of layers by type and name stay consistent
+        :return: list of MapLayer
+        """
+        return self._layers
+
+    @layers.setter
+    def layers(self, layers: List[MapLayer]):
+        self._layers = list(layers)
+        self._layers_by_type.clear()
+        self._layers_by_name.clear()
+        for layer in self._layers:
+            self._index_layer(layer)
+
+    def _index_layer(self, layer: MapLayer):
+        # first layer of type wins, as for linear search
+        self._layers_by_type.setdefault(layer.type, layer)
+        self._layers_by_name.setdefault(str(layer.type), layer)
+
     def __iter__(self):
         yield from {
             'name': self.name,
@@ -49,21 +75,15 @@ class DuckietownMap:
         :param name: name of layer
         :return: list, if name doesn't exist, return None
         """
-        for layer in self.layers:
-            if str(layer.type) == name:
-                return layer
-        return None
+        return self._layers_by_name.get(name)
 
-    def get_layer_by_type(self, layer_type: LayerType):
+    def get_layer_by_type(self, layer_type: LayerType) -> Optional[MapLayer]:
         """
         Get layer by type
         :param layer_type: type of layer
         :return: list, if layer w/ type doesn't exist, return None
         """
-        for layer in self.layers:
-            if layer.type == layer_type:
-                return layer
-        return None
+        return self._layers_by_type.get(layer_type)
 
     def get_object_layers(self, only_visible=False):
         """
@@ -96,6 +116,18 @@ class DuckietownMap:
         """
         self.set_layer_data_by_type(LayerType.TILES, layer)
 
+    def compact_tile_layer(self):
+        """
+        Store tile layer's data as TileGrid (arrays of kinds and rotations instead of list(list) of MapTile)
+        :return: bool, return False if layer doesn't exist, else True
+        """
+        layer = self.get_tile_layer()
+        if layer is None:
+            return False
+        if not isinstance(layer.data, TileGrid):
+            layer.data = TileGrid.from_tiles(layer.data)
+        return True
+
     def set_item_layer(self, layer: list):
         """
         Set item layer's data
@@ -134,10 +166,11 @@ class DuckietownMap:
             return False
 
     def set_layer(self, new_layer: MapLayer):
-        for i, layer in enumerate(self.layers):
-            if layer.type == new_layer.type:
-                self.layers[i] = new_layer
-                return True
+        layer = self.get_layer_by_type(new_layer.type)
+        if layer is not None:
+            self._layers[self._layers.index(layer)] = new_layer
+            self._layers_by_type[new_layer.type] = self._layers_by_name[str(new_layer.type)] = new_layer
+            return True
         logger.info("Layer with type '{}' doesn't exists. Can't set new layer".format(new_layer.type))
 
     # Creating layer
@@ -170,7 +203,8 @@ class DuckietownMap:
                         "set_layer_name/set_layer_name_by_type".format(layer.type))
             return False
         else:
-            self.layers.append(layer)
+            self._layers.append(layer)
+            self._index_layer(layer)
             return True
 
     # Adding elem to layers
@@ -253,5 +287,6 @@ class DuckietownMap:
                 self.add_layer_from_data(layer_type, objects_to_layer, layer_name)
 
     def clear_objects_layers(self):
-        self.layers = [self.get_layer_by_type(LayerType.TILES)]
+        tile_layer = self.get_layer_by_type(LayerType.TILES)
+        self.layers = [tile_layer] if tile_layer else []
    
\ No newline at end of file
@@ -1,44 +1,41 @@
 # -*- coding: utf-8 -*-
 from map import DuckietownMap
 from mapviewer import MapViewer
-from collections import deque
-import copy
+from contextlib import contextmanager
+from dt_journal import ChangeJournal
+from tile_grid import TileGrid
+from undo_stack import UndoStack, TileBlockChange, TileGridResize, TileGridGrow, ObjectsRemoved, ObjectsAdded, \
+    ObjectsMoved
+import numpy as np
 
 
 # Don't forget call setMap on map change
 class MapEditor:
-    memento = None
+    history = None
     map = None
     viewer = None
 
     def __init__(self, map: DuckietownMap, viewer: MapViewer):
         self.map = map
         self.viewer = viewer
-        self.memento = deque([], maxlen=150)
+        self.history = UndoStack()
 
     @DeprecationWarning
     def setMap(self, newMap: DuckietownMap):
         self.map = newMap
 
     def __createBuffer(self, selection):
-        buffer = []
         tile_layer = self.map.get_tile_layer().data
-        for i in range(selection[3] - selection[1]):
-            buffer.append([])
-            for j in range(selection[2] - selection[0]):
-                buffer[i].append(copy.copy(
-                    tile_layer[selection[1] + i][selection[0] + j]))
-                # buffer[i][j] = copy.copy(
-                #     self.map.tiles[selection[1] + i][selection[0] + j])
-        return buffer
+        return tile_layer.copy_block(slice(selection[1], selection[3]), slice(selection[0], selection[2]))
 
     def __extendAndPasteBuffer(self, selection, buffer, destX, destY, backgroundTile):
         self.extendToFit(selection, destX, destY, backgroundTile)
         tile_layer = self.map.get_tile_layer().data
-        for i in range(len(buffer)):
-            for j in range(len(buffer[i])):
-                # print('paste to ['+str(destX + j)+' ; ' + str(destY + i)+ ']')
-                tile_layer[destY + i][destX + j] = buffer[i][j]
+        # map is extended to the left/top, if destination is negative
+        destX, destY = max(0, destX), max(0, destY)
+        height, width = buffer.shape
+        with self.__recordBlock(tile_layer, slice(destY, destY + height), slice(destX, destX + width)):
+            tile_layer.paste_block(destY, destX, buffer)
 
     def extendToFit(self, selection, destX, destY, backgroundTile):
         tile_layer = self.map.get_tile_layer().data
@@ -57,111 +54,193 @@ class MapEditor:
 
     # TO TEST
     def copySelection(self, selection, destX, destY, backgroundTile):
-        buffer = self.__createBuffer(selection)
-        self.__extendAndPasteBuffer(selection, buffer, destX, destY, backgroundTile)
+        with self.__recording():
+            buffer = self.__createBuffer(selection)
+            self.__extendAndPasteBuffer(selection, buffer, destX, destY, backgroundTile)
         return
 
     # TO TEST
     def moveSelection(self, selection, destX, destY, backgroundTile):
-        buffer = self.__createBuffer(selection)
-        self.deleteSelection(selection, backgroundTile)
-        self.__extendAndPasteBuffer(selection, buffer, destX, destY, backgroundTile)
+        with self.__recording():
+            buffer = self.__createBuffer(selection)
+            self.deleteSelection(selection, backgroundTile)
+            self.__extendAndPasteBuffer(selection, buffer, destX, destY, backgroundTile)
         return
 
     # TO TEST
     def deleteSelection(self, selection, backgroundTile):
+        with self.__recording():
+            self.__deleteSelection(selection, backgroundTile)
+
+    def __deleteSelection(self, selection, backgroundTile):
         tile_layer = self.map.get_tile_layer().data
-        for y in range(max(0, selection[1]), min(selection[3], len(tile_layer))):
-            for x in range(max(0, selection[0]), min(selection[2], len(tile_layer[0]))):
-                tile_layer[y][x] = copy.copy(backgroundTile)
-        return
+        y_slice = slice(max(0, selection[1]), max(0, min(selection[3], tile_layer.shape[0])))
+        x_slice = slice(max(0, selection[0]), max(0, min(selection[2], tile_layer.shape[1])))
+        with self.__recordBlock(tile_layer, y_slice, x_slice):
+            tile_layer.fill(y_slice, x_slice, backgroundTile)
 
     # TO TEST
     def addBorderLines(self, linesUp: int, linesRight: int, linesDown: int, linesLeft: int, backgroundTile):
+        with self.__recording():
+            self.__addBorderLines(linesUp, linesRight, linesDown, linesLeft, backgroundTile)
+
+    def __addBorderLines(self, linesUp: int, linesRight: int, linesDown: int, linesLeft: int, backgroundTile):
         tile_layer = self.map.get_tile_layer().data
-        for i in range(linesUp):
-            l = len(tile_layer[0])
-            tile_layer.insert(0, [])
-            for j in range(l):
-                tile_layer[0].append(copy.copy(backgroundTile))
-        for i in range(linesDown):
-            emptyLine = []
-            l = len(tile_layer[0])
-            for j in range(l):
-                emptyLine.append(copy.copy(backgroundTile))
-            if len(tile_layer[len(tile_layer)-1]) == 0:
-                tile_layer[len(tile_layer)-1] = emptyLine
-            else:
-                tile_layer.append(emptyLine)
-        for j in range(len(tile_layer)):
-            for i in range(linesLeft):
-                tile_layer[j].insert(0, copy.copy(backgroundTile))
-            for i in range(linesRight):
-                tile_layer[j].append(copy.copy(backgroundTile))
-        return
+        if not (linesUp or linesRight or linesDown or linesLeft):
+            return
+        if linesDown and tile_layer.shape[1] == 0:
+            # the last empty line is replaced by new lines
+            with self.__recordResize(tile_layer):
+                tile_layer.crop(slice(0, -1), slice(None))
+            linesDown -= 1
+        lines = (linesUp, linesRight, linesDown, linesLeft)
+        before = (tile_layer.kind_codes, tile_layer.rotations)
+        if tile_layer.pad(*lines, backgroundTile):
+            # only edges of grid are moved, arrays before are parts of current ones
+            self.history.push(TileGridGrow(tile_layer, lines))
+        else:
+            self.history.push(TileGridResize(tile_layer, before))
 
         #  Removes lines at the edges if all tiles in the row are background
         # TO TEST
 
     def trimBorders(self, trimUp: bool, trimRight: bool, trimDown: bool, trimLeft: bool, backgroundTile):
-        isLineEmpty = True
+        with self.__recording():
+            self.__trimBorders(trimUp, trimRight, trimDown, trimLeft, backgroundTile)
+
+    def __trimBorders(self, trimUp: bool, trimRight: bool, trimDown: bool, trimLeft: bool, backgroundTile):
         tile_layer = self.map.get_tile_layer().data
-        if trimDown:
-            while isLineEmpty and tile_layer:
-                for i in range(len(tile_layer[len(tile_layer) - 1])):
-                    if tile_layer[len(tile_layer) - 1][i].kind != backgroundTile.kind:
-                        isLineEmpty = False
-                        break
-                if isLineEmpty:
-                    tile_layer.pop()
-        isLineEmpty = True
-        if trimUp:
-            while isLineEmpty and tile_layer:
-                for i in range(len(tile_layer[0])):
-                    if tile_layer[0][i].kind != backgroundTile.kind:
-                        isLineEmpty = False
-                        break
-                if isLineEmpty:
-                    tile_layer.pop(0)
-        isLineEmpty = True
-        if trimRight:
-            while isLineEmpty and tile_layer:
-                for i in range(len(tile_layer)):
-                    if tile_layer[i][len(tile_layer[i]) - 1].kind != backgroundTile.kind:
-                        isLineEmpty = False
-                        break
-                if isLineEmpty:
-                    for i in range(len(tile_layer)):
-                        tile_layer[i].pop()
-        isLineEmpty = True
-        if trimLeft:
-            while isLineEmpty and tile_layer:
-                for i in range(len(tile_layer)):
-                    if tile_layer[i][0].kind != backgroundTile.kind:
-                        isLineEmpty = False
-                        break
-                if isLineEmpty:
-                    for i in range(len(tile_layer)):
-                        tile_layer[i].pop(0)
-        if not tile_layer:
-            self.map.set_tile_layer([[]])
-        return
+        # background is found by codes of kinds
+        not_empty = tile_layer.kind_codes != tile_layer.intern(backgroundTile.kind)
+        bounds = self.__trimBounds(not_empty, trimUp, trimRight, trimDown, trimLeft)
+        if bounds is None:
+            # map of background tiles becomes one empty line
+            bounds = (slice(0, 1), slice(0, 0))
+        if bounds == (slice(0, not_empty.shape[0]), slice(0, not_empty.shape[1])):
+            return
+        y_slice, x_slice = bounds
+        with self.__recordResize(tile_layer):
+            tile_layer.crop(y_slice, x_slice)
+
+    @staticmethod
+    def __trimBounds(not_empty: np.ndarray, trimUp: bool, trimRight: bool, trimDown: bool, trimLeft: bool):
+        """
+        Find block of tiles, which is kept by trim, in one scan
+        :param not_empty: bool array [y][x], True for tiles, which aren't background
+        :return: (y slice, x slice), None if all tiles are trimmed
+        """
+        rows, columns = np.flatnonzero(not_empty.any(axis=1)), np.flatnonzero(not_empty.any(axis=0))
+        height, width = not_empty.shape
+        if not len(rows):
+            return None if trimUp or trimRight or trimDown or trimLeft else (slice(0, height), slice(0, width))
+        return (slice(int(rows[0]) if trimUp else 0, int(rows[-1]) + 1 if trimDown else height),
+                slice(int(columns[0]) if trimLeft else 0, int(columns[-1]) + 1 if trimRight else width))
+
+    # Undo history. Edits record only changed data (see undo_stack.py)
+
+    @contextmanager
+    def __recording(self):
+        """
+        Group commands of edit into one. Tile layer stored as list(list) is compacted to TileGrid first,
+        so edits record only changed blocks of tiles
+        """
+        self.map.compact_tile_layer()
+        with self.history.macro():
+            yield
 
-    def save(self, map_to_save):
-        # deep copy
-        backup = DuckietownMap(empty=True)
-        # Fill backup layers
-        for layer in map_to_save.layers:
-            backup.add_layer(copy.deepcopy(layer))
-        if len(self.memento) == self.memento.maxlen - 1:
-            self.memento.popleft()
-        self.memento.append(backup)
+    @contextmanager
+    def __recordBlock(self, tile_layer: TileGrid, y_slice: slice, x_slice: slice):
+        before = tile_layer.copy_block(y_slice, x_slice)
+        yield
+        self.history.push(TileBlockChange(tile_layer, y_slice.start, x_slice.start, before,
+                                          tile_layer.copy_block(y_slice, x_slice)))
+
+    @contextmanager
+    def __recordResize(self, tile_layer: TileGrid):
+        before = (tile_layer.kind_codes, tile_layer.rotations)
+        yield
+        if tile_layer.kind_codes is not before[0] or tile_layer.rotations is not before[1]:
+            self.history.push(TileGridResize(tile_layer, before))
+
+    def begin_transaction(self):
+        """
+        Start edit, which lasts over several events (e.g. burst of nudges);
+        its commands become one step of history on commit
+        :return: -
+        """
+        self.history.begin_transaction()
+
+    def commit(self):
+        """
+        Finish edit started by begin_transaction
+        :return: -
+        """
+        self.history.commit()
+
+    @contextmanager
+    def dt_edit(self):
+        """
+        Record changes of dt-world map made inside `with` block as one command.
+        Edit must watch attributes before changing them (see ChangeJournal)
+        :return: ChangeJournal
+        """
+        journal = ChangeJournal()
+        try:
+            yield journal
+        finally:
+            # partially applied edit is recorded too
+            self.commit_journal(journal)
+
+    def commit_journal(self, journal: ChangeJournal):
+        """
+        Add changes of dt-world map, which are journaled, to history
+        :param journal: ChangeJournal of finished edit
+        :return: -
+        """
+        command = journal.commit()
+        if command is not None:
+            self.history.push(command)
+
+    def add_objects(self, layer, objects: list):
+        """
+        Add objects to layer w/ undo
+        :param layer: MapLayer
+        :param objects: list of objects
+        :return: -
+        """
+        start = len(layer.data)
+        layer.add_elem(objects)
+        ids = layer.get_ids()[start:]
+        self.history.push(ObjectsAdded(layer, layer.get_placed_objects(ids)))
+
+    def remove_objects(self, layer, obj_ids):
+        """
+        Remove objects from layer w/ undo
+        :param layer: MapLayer
+        :param obj_ids: ids of objects
+        :return: -
+        """
+        items = layer.get_placed_objects(obj_ids)
+        if items:
+            layer.remove_objects([obj_id for _, obj_id, _ in items])
+            self.history.push(ObjectsRemoved(layer, items))
+
+    def move_objects(self, objects: list, dx: float, dy: float):
+        """
+        Record shift of objects, which are already moved
+        :return: -
+        """
+        if objects:
+            self.history.push(ObjectsMoved(objects, dx, dy))
 
     def undo(self):
-        if len(self.memento) == 0:
-            return
-        backup = self.memento.pop()
-        self.map.layers.clear()
-        # Fill layers from backup
-        for layer in backup.layers:
-            self.map.add_layer(layer)
+        """
+        :return: undone command, None if history is empty
+        """
+        return self.history.undo()
+
+    def redo(self):
+        """
+        :return: redone command, None if there is nothing to redo
+        """
+        return self.history.redo()
@@ -1,38 +1,155 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import Tuple, Dict
+import math
+from collections import OrderedDict
+from typing import Tuple, Dict, List, Union
 
-from PyQt5.QtGui import QTransform
 from PyQt5.QtWidgets import QGraphicsView
 from PyQt5 import QtCore, QtGui, QtWidgets
 from duckietown_world.structure.objects import Tile, _Tile
 from duckietown_world.structure.utils import get_degree_for_orientation, get_canonical_sign_name
 
 from map import DuckietownMap
-from utils import get_list_dir_with_path
 from classes.mapObjects import MapBaseObject
 import numpy as np
 import duckietown_world.structure as st
-from DTWorld import get_dt_world
+from DTWorld import get_dt_world, get_pose_cache
+from dt_journal import ChangeJournal
+from render_profiler import RenderProfiler, profiled
+from repaint_scheduler import RepaintScheduler
+from sprite_batch import SpriteBatch
+from sprite_library import SpriteLibrary, ATLAS_MANIFEST_PATH, ATLAS_GROUP_TILES, ATLAS_GROUP_OBJECTS, \
+    TILES_DIR_PATH, OBJECT_DIR_PATHS
+from tile_chunks import TileChunkStore
 import os
 
 logger = logging.getLogger('root')
 
-TILES_DIR_PATH = './img/tiles'
-OBJECT_DIR_PATHS = ['./img/signs',
-                    './img/apriltags',
-                    './img/objects']
-
 DELTA_EUCLIDEAN_DISTANCE = .15
+SPRITE_CACHE_PIXELS = 64 * 2 ** 20  # max pixels of scaled sprite pages kept by SpriteCache
+# Levels of detail
+LOD_FULL = 0  # full-resolution antialiased sprites
+LOD_MIPMAP = 1  # sprites from pre-downsampled pages, w/o antialiasing
+LOD_FLAT = 2  # flat colour per tile type, dots instead of object sprites, w/o tile outlines
+LOD_MIPMAP_SCALE = 0.5  # zoom below which LOD_MIPMAP is used
+LOD_FLAT_SCALE = 0.15  # zoom below which LOD_FLAT is used
 
 
 # TILE_SIZE = 0.585
 
 
+class SpriteCache:
+    """
+    Cache of sprite pages (atlases or separate images, see SpriteLibrary.get_region), scaled to power-of-two
+    levels and stored as ready-to-blit QPixmap. Sprite is drawn as a source rect of its page, the rest of scaling
+    and rotation is applied while blitting, so all sprites of one page are drawn w/ one call of SpriteBatch.
+    For current zoom each page is kept at one level: the largest one, requested by its sprites (but not above
+    full resolution). Pages are evicted in LRU order, when they take more than max_pixels.
+    Also keeps average colours of sprites for low levels of detail
+    """
+
+    def __init__(self, sprites: SpriteLibrary, max_pixels: int = SPRITE_CACHE_PIXELS):
+        self.sprites = sprites
+        self.max_pixels = max_pixels
+        self.zoom = None
+        self.hits = 0
+        self.misses = 0
+        self._cache: Dict[Tuple[int, int], QtGui.QPixmap] = OrderedDict()  # (cacheKey of page, level) -> pixmap
+        self._pixels = 0
+        self._levels: Dict[int, int] = {}  # cacheKey of page -> level for current zoom
+        self._colors: Dict[str, QtGui.QColor] = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+        self._pixels = 0
+        self._levels.clear()
+
+    def set_sprites(self, sprites: SpriteLibrary):
+        """
+        Replace sprite set. Invalidates cache
+        :param sprites: sprite library
+        :return: -
+        """
+        self.sprites = sprites
+        self._colors.clear()
+        self.clear()
+
+    def set_zoom(self, zoom: float):
+        """
+        Let pages choose their levels again if zoom has been changed. Scaled pages are kept
+        :param zoom: current scale of viewer
+        :return: -
+        """
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self._levels.clear()
+
+    def get(self, name: str, size: float) -> Tuple[QtGui.QPixmap, QtCore.QRectF]:
+        """
+        Get page of sprite, scaled for sprite of size x size pixels, and rect of sprite in it
+        :param name: name of sprite
+        :param size: side of sprite on screen, pixels
+        :return: (QPixmap, source QRectF), null pixmap and empty rect if sprite can't be drawn
+        """
+        page, rect = self.sprites.get_region(name)
+        if page.isNull() or rect.isEmpty():
+            return QtGui.QPixmap(), QtCore.QRectF()
+        page_key = page.cacheKey()
+        level = min(0, math.ceil(math.log2(max(1., size) / max(rect.width(), rect.height()))))
+        level = self._levels[page_key] = max(level, self._levels.get(page_key, level))
+        pixmap = self._get_page(page, page_key, level)
+        scale_x, scale_y = pixmap.width() / page.width(), pixmap.height() / page.height()
+        source = QtCore.QRectF(rect.x() * scale_x, rect.y() * scale_y, rect.width() * scale_x,
+                               rect.height() * scale_y)
+        if rect != page.rect():
+            # don't sample neighbours of sprite in atlas
+            source.adjust(.5, .5, -.5, -.5)
+        return pixmap, source
+
+    def get_color(self, name: str) -> QtGui.QColor:
+        """
+        Get average colour of sprite (opaque)
+        :param name: name of sprite
+        :return: QColor
+        """
+        color = self._colors.get(name)
+        if color is None:
+            img = self.sprites[name].convertToFormat(QtGui.QImage.Format_ARGB32_Premultiplied)
+            color = img.scaled(1, 1, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation).pixelColor(0, 0)
+            color.setAlpha(255)
+            self._colors[name] = color
+        return color
+
+    def _get_page(self, page: QtGui.QImage, page_key: int, level: int) -> QtGui.QPixmap:
+        key = (page_key, level)
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return pixmap
+        self.misses += 1
+        if level == 0:
+            pixmap = QtGui.QPixmap.fromImage(page)
+        else:
+            scale = 2. ** level
+            pixmap = QtGui.QPixmap.fromImage(page.scaled(max(1, round(page.width() * scale)),
+                                                         max(1, round(page.height() * scale)),
+                                                         QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation))
+        self._cache[key] = pixmap
+        self._pixels += pixmap.width() * pixmap.height()
+        while self._pixels > self.max_pixels and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self._pixels -= evicted.width() * evicted.height()
+        return pixmap
+
+
 class MapViewer(QGraphicsView, QtWidgets.QWidget):
     map = None
-    tileSprites: Dict[str, QtGui.QImage] = {'empty': QtGui.QImage()}
-    objects = {get_canonical_sign_name('stop'): QtGui.QImage()}
+    tileSprites: SpriteLibrary = None
+    objects: SpriteLibrary = None
     offsetX = 0
     offsetY = 0
     sc = 1
@@ -42,6 +159,9 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
     lmbPressed = False
     drag_mode = False
     drag_obj = None
+    drag_name = None
+    #  Journal of pose of dragged frame, it's passed by dragFinished on release
+    drag_journal = None
     rmbPrevPos = [0, 0]
     mouseStartX, mouseStartY = 0, 0
     mouseCurX, mouseCurY = 0, 0
@@ -50,68 +170,161 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
     #  If the selection is outside the array to the left, contains -1
     #  If the selection is outside the array to the right - width / height
     tileSelection = [0] * 4
+    #  Visible area in coordinates of the global transform (view shifted by offsetX/offsetY); updated on each paint
+    view_rect = QtCore.QRectF()
+    #  Count of drawn and culled items during the last paint
+    drawn_items = 0
+    culled_items = 0
+    lod = LOD_FULL
+    draw_selection = True
+    first_frame_drawn = False
+    #  Tiles of dt-world map as 2d-list [i][j] and its size; rebuilt after adding or removing of tiles
+    _tile_grid = None
+    _tile_grid_dm = None
+    grid_width = 0
+    grid_height = 0
     selectionChanged = QtCore.pyqtSignal()
     editObjectChanged = QtCore.pyqtSignal(tuple)
     lmbClicked = QtCore.pyqtSignal(int, int)  # click coordinates as an index of the clicked tile
+    firstFrameDrawn = QtCore.pyqtSignal()
+    dragFinished = QtCore.pyqtSignal(object)  # ChangeJournal of drag
 
-    def __init__(self):
+    def __init__(self, profile_render: bool = False, dm=None):
         QGraphicsView.__init__(self)
-        map_name = os.path.abspath("maps/tm1")
-        # print(map_name)
-        self.dm = get_dt_world(map_name)
+        self.profiler = RenderProfiler(profile_render)
+        if dm is None:
+            map_name = os.path.abspath("maps/tm1")
+            # print(map_name)
+            dm = get_dt_world(map_name)
+        self.dm = dm
         self.setScene(QtWidgets.QGraphicsScene())
-        # load tiles
-        for filename, file_path in get_list_dir_with_path(TILES_DIR_PATH):
-            tile_name = filename.split('.')[0]
-            self.tileSprites[tile_name] = QtGui.QImage()
-            self.tileSprites[tile_name].load(file_path)
-        # load objects
-        for dir_path in OBJECT_DIR_PATHS:
-            for filename, file_path in get_list_dir_with_path(dir_path):
-                object_name = filename.split('.')[0]
-                self.objects[get_canonical_sign_name(object_name)] = QtGui.QImage()
-                self.objects[get_canonical_sign_name(object_name)].load(file_path)
+        # sprites of current map are loaded at once, others - in background or on first use
+        self.tileSprites = SpriteLibrary()
+        self.tileSprites.add_image('empty', QtGui.QImage())
+        if not self.tileSprites.add_atlas(ATLAS_MANIFEST_PATH, ATLAS_GROUP_TILES, [TILES_DIR_PATH]):
+            self.tileSprites.add_dir(TILES_DIR_PATH)
+        self.objects = SpriteLibrary()
+        self.objects.add_image(get_canonical_sign_name('stop'), QtGui.QImage())
+        if not self.objects.add_atlas(ATLAS_MANIFEST_PATH, ATLAS_GROUP_OBJECTS, OBJECT_DIR_PATHS,
+                                      get_canonical_sign_name):
+            for dir_path in OBJECT_DIR_PATHS:
+                self.objects.add_dir(dir_path, get_canonical_sign_name)
+        tile_names, object_names = self.get_used_sprites()
+        self.tileSprites.preload(tile_names)
+        self.objects.preload(object_names)
+        self.tileSprites.load_in_background()
+        self.objects.load_in_background()
+        self.tile_cache = SpriteCache(self.tileSprites)
+        self.object_cache = SpriteCache(self.objects)
+        self.tile_store = TileChunkStore(self.draw_tile_block)
+        self.repaint_scheduler = RepaintScheduler(self.viewport())
+
+    def get_used_sprites(self) -> Tuple[set, set]:
+        """
+        Get names of sprites, which are needed to draw current dt-world map
+        :return: (names of tile sprites, names of object sprites)
+        """
+        tile_names = {tile.type for column in self.get_tile_grid() for tile in column}
+        object_names = {'watchtower', 'duckie', 'apriltag', 'duckiebot'}
+        for objects in (self.dm.traffic_signs, self.dm.decorations):
+            object_names.update(obj.type for _, obj in objects or ())
+        return tile_names, object_names
 
     def setMap(self, tiles: DuckietownMap):
         self.map = tiles
         self.raw_selection = [0] * 4
         self.tileSelection = [0] * 4
+        self.invalidate_tiles()
         self.scene().update()
 
-    def get_x_from_view(self, x_view: float) -> float:
-        logger.debug((x_view - self.offsetX) / self.sc / self.map.gridSize * self.tile_size)
-        print('X F V', x_view - self.offsetX,  x_view)
-        print((x_view - self.offsetX) / self.sc / self.map.gridSize * self.tile_size)
+    def invalidate_tiles(self, tiles=None):
+        """
+        Re-render changed tiles of tile layer on next paint
+        :param tiles: iterable of (i, j) of changed tiles; if None, whole layer is changed (tiles may be added or
+        removed, so grid of tiles is rebuilt too)
+        :return: -
+        """
+        if tiles is None:
+            self._tile_grid = None
+        self.tile_store.invalidate(tiles)
+
+    def get_tile_grid(self) -> List[List[_Tile]]:
+        """
+        Get tiles of dt-world map as 2d-list [i][j]. Grid is cached until invalidate_tiles() w/o arguments
+        or replacing of dt-world map
+        :return: list of columns of tiles
+        """
+        if self._tile_grid is None or self._tile_grid_dm is not self.dm:
+            self._tile_grid = self.dm.tiles.only_tiles()
+            self._tile_grid_dm = self.dm
+            self.grid_width = len(self._tile_grid)
+            self.grid_height = len(self._tile_grid[0]) if self._tile_grid else 0
+        return self._tile_grid
+
+    def fit_to_size(self, width: int, height: int, zoom: float = None):
+        """
+        Center map in area of given size
+        :param width: width of area, pixels
+        :param height: height of area, pixels
+        :param zoom: zoom of viewer; if None, the whole map fits the area
+        :return: -
+        """
+        self.get_tile_grid()
+        map_width, map_height = self.grid_width * self.map.gridSize, self.grid_height * self.map.gridSize
+        if zoom is None:
+            zoom = min(width / map_width, height / map_height) if map_width and map_height else 1
+        self.sc = zoom
+        self.offsetX = (width - map_width * zoom) / 2
+        self.offsetY = (height - map_height * zoom) / 2
+
+    def render_image(self, width: int, height: int) -> QtGui.QImage:
+        """
+        Render map into image w/ the same drawing code as the viewport, so it works w/o window
+        :param width: width of image, pixels
+        :param height: height of image, pixels
+        :return: QImage
+        """
+        self.resize(width, height)
+        image = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+        painter = QtGui.QPainter(image)
+        rect = QtCore.QRectF(0, 0, width, height)
+        self.drawBackground(painter, rect)
+        self.drawForeground(painter, rect)
+        painter.end()
+        return image
+
+    # Transforms between viewer and map coordinates; they take numbers or numpy arrays of coordinates
+
+    def get_x_from_view(self, x_view: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
         #return self.i_tile * self.tile_size - (x_view - self.offsetX) / self.sc / self.map.gridSize * self.tile_size
         return (x_view - self.offsetX) / self.sc / self.map.gridSize * self.tile_size
 
-    def get_y_from_view(self, y_view: float) -> float:
-        logger.debug((len(self.dm.tiles.only_tiles()[0]) - (y_view - self.offsetY) / self.sc / self.map.gridSize) \
-                     * self.tile_size)
-        return (len(self.dm.tiles.only_tiles()[0]) - (y_view - self.offsetY) / self.sc / self.map.gridSize) \
+    def get_y_from_view(self, y_view: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        self.get_tile_grid()
+        return (self.grid_height - (y_view - self.offsetY) / self.sc / self.map.gridSize) \
                * self.tile_size
 
-    def get_x_to_view(self, x_real: float) -> float:
-        print('LEN -', self.i_tile * self.tile_size)
-        print(x_real)
-        print((x_real + 0) * self.sc * self.map.gridSize / self.tile_size)
-
+    def get_x_to_view(self, x_real: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
         #return (self.i_tile * self.tile_size - x_real + 0) * self.sc * self.map.gridSize / self.tile_size
         return (x_real + 0) * self.sc * self.map.gridSize / self.tile_size
 
-    def get_y_to_view(self, y_real: float) -> float:
-        return ((len(self.dm.tiles.only_tiles()[0]) - y_real / self.tile_size) + 0) * self.sc * self.map.gridSize
+    def get_y_to_view(self, y_real: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        self.get_tile_grid()
+        return ((self.grid_height - y_real / self.tile_size) + 0) * self.sc * self.map.gridSize
 
     def wheelEvent(self, event: QtGui.QWheelEvent) -> None:
         sf = 2 ** (event.angleDelta().y() / 240)
         if (self.sc < 0.05 and sf < 1) or (self.sc > 100 and sf > 1):
             return
         self.sc *= sf
-        self.scene().update()
+        self.schedule_repaint()
 
     def mouseReleaseEvent(self, event: QtGui.QMouseEvent) -> None:
         self.drag_mode = False
-        self.drag_obj = None
+        self.drag_obj = self.drag_name = None
+        if self.drag_journal is not None:
+            journal, self.drag_journal = self.drag_journal, None
+            self.dragFinished.emit(journal)
         if event.button() == QtCore.Qt.LeftButton:
             self.lmbPressed = False
             if int((self.mouseStartX - self.offsetX) / self.sc * self.map.gridSize) == int(
@@ -137,23 +350,95 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
             self.selectionChanged.emit()
         else:
             self.rmbPressed = False
-        self.scene().update()
+        self.schedule_repaint()
 
     def remove_last_obj(self):
         print(self.drag_obj)
-        self.drag_obj = None
+        self.drag_obj = self.drag_name = None
+
+    def schedule_repaint(self, rect: QtCore.QRectF = None):
+        """
+        Repaint viewport on next display refresh, requests before it are merged
+        :param rect: dirty rect in viewport coordinates; if None, the whole viewport
+        :return: -
+        """
+        # HUD must be repainted w/ every frame
+        self.repaint_scheduler.request(None if self.profiler.enabled else rect)
+
+    def get_objects_view_rect(self, points: np.ndarray) -> QtCore.QRectF:
+        """
+        Get area of viewport covered by sprites of objects
+        :param points: array of world positions (x, y), not empty
+        :return: rect in viewport coordinates
+        """
+        x_view = self.get_x_to_view(points[:, 0]) + self.offsetX
+        y_view = self.get_y_to_view(points[:, 1]) + self.offsetY
+        # sprite may be rotated, so half of its diagonal is enough
+        margin = self.map.gridSize * self.sc / 2 * .75 + 2
+        return QtCore.QRectF(QtCore.QPointF(x_view.min(), y_view.min()), QtCore.QPointF(x_view.max(), y_view.max())
+                             ).adjusted(-margin, -margin, margin, margin)
+
+    def get_selection_view_rect(self) -> QtCore.QRectF:
+        return QtCore.QRectF(QtCore.QPointF(self.mouseStartX, self.mouseStartY),
+                             QtCore.QPointF(self.mouseCurX, self.mouseCurY)).normalized().adjusted(-1, -1, 2, 2)
+
+    def frames_changed(self, names=None):
+        """
+        Update cached world poses after changing of frames
+        :param names: names of frames with changed pose; if None, frames were added or removed
+        :return: -
+        """
+        if names is None:
+            get_pose_cache(self.dm).invalidate()
+        else:
+            get_pose_cache(self.dm).mark_dirty(names)
+
+    def attributes_changed(self, changed: List[Tuple[object, str]]):
+        """
+        Update cached poses and tiles after attributes of dt-world map were changed outside of viewer (e.g. by undo)
+        :param changed: list of (object, name of attribute)
+        :return: -
+        """
+        poses = get_pose_cache(self.dm)
+        tiles = self.get_tile_grid()
+        changed_poses, changed_tiles = [], []
+        all_tiles = False
+        for obj, name in changed:
+            if name == 'relative_to':
+                poses.invalidate()
+            elif name in ('x', 'y', 'yaw'):
+                changed_poses.append(obj)
+            elif name in ('type', 'orientation'):
+                i, j = getattr(obj, 'i', None), getattr(obj, 'j', None)
+                if i is None or j is None:
+                    # not a tile
+                    continue
+                if isinstance(i, int) and isinstance(j, int) and 0 <= i < self.grid_width \
+                        and 0 <= j < self.grid_height and tiles[i][j] is obj:
+                    changed_tiles.append((i, j))
+                else:
+                    # tile isn't in cached grid
+                    all_tiles = True
+        poses.mark_poses_dirty(changed_poses)
+        if all_tiles:
+            self.invalidate_tiles()
+        elif changed_tiles:
+            self.invalidate_tiles(changed_tiles)
 
     def mousePressEvent(self, event: QtGui.QMouseEvent) -> None:
         x, y = event.x(), event.y()
         x_map = self.get_x_from_view(x)
         y_map = self.get_y_from_view(y)
         if event.buttons() == QtCore.Qt.LeftButton:
-            drag_obj, _ = self.find_object(x_map, y_map)
+            drag_obj, (drag_name, _) = self.find_object(x_map, y_map)
             print('before drag,', x_map, y_map)
             if drag_obj:
                 print(drag_obj)
                 self.drag_obj = drag_obj
+                self.drag_name = drag_name
                 self.drag_mode = True
+                self.drag_journal = ChangeJournal()
+                self.drag_journal.watch(drag_obj.pose, 'x', 'y')
                 return
         if event.buttons() == QtCore.Qt.RightButton:
             obj, (name, tp) = self.find_object(x_map, y_map)
@@ -169,19 +454,12 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
             self.mouseCurY = self.mouseStartY = y
 
     def find_object(self, x, y) -> Tuple:
-        event_x = np.array((x, y))
-        for frame_name, frame in self.dm.frames:
-            obj_x = frame.pose.x
-            obj_y = frame.pose.y
-            obj_array = np.array((obj_x, obj_y))
-            if np.linalg.norm(obj_array - event_x) < DELTA_EUCLIDEAN_DISTANCE:
-                logger.debug('Found frame: {}'.format(frame))
-                try:
-                    name, _ = frame_name
-                    print('Tile of frame-{}:'.format(name), self.dm.tiles[name])
-                except:
-                    pass
-                return frame, frame_name
+        poses = get_pose_cache(self.dm)
+        idx = poses.nearest(x, y, DELTA_EUCLIDEAN_DISTANCE)
+        if idx is not None:
+            frame = poses.get_frame(idx)
+            logger.debug('Found frame: {}'.format(frame))
+            return frame, poses.keys[idx]
         return None, (None, None)
 
     def mouseMoveEvent(self, event: QtGui.QMouseEvent) -> None:
@@ -189,65 +467,177 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
         x_map = self.get_x_from_view(x)
         y_map = self.get_y_from_view(y)
         if self.drag_mode:
-            self.drag_obj.pose.x = x_map
-            self.drag_obj.pose.y = y_map
-            self.scene().update()
+            poses = get_pose_cache(self.dm)
+            self.drag_obj.pose.x, self.drag_obj.pose.y = poses.to_local(self.drag_name, x_map, y_map)
+            old_world = poses.world[:, :2].copy()
+            poses.mark_dirty([self.drag_name])
+            changed = poses.update()
+            if len(old_world) != len(poses.world):
+                self.schedule_repaint()
+            elif len(changed):
+                # repaint old and new places of dragged frame and its children
+                self.schedule_repaint(self.get_objects_view_rect(
+                    np.concatenate((old_world[changed], poses.world[changed, :2]))))
         elif self.rmbPressed:
             self.offsetX += event.x() - self.rmbPrevPos[0]
             self.offsetY += event.y() - self.rmbPrevPos[1]
             self.rmbPrevPos = [event.x(), event.y()]
-            self.scene().update()
+            self.schedule_repaint()
         elif self.lmbPressed:
+            old_rect = self.get_selection_view_rect()
             self.mouseCurX = event.x()
             self.mouseCurY = event.y()
-            self.scene().update()
+            self.schedule_repaint(old_rect.united(self.get_selection_view_rect()))
 
     def drawBackground(self, painter: QtGui.QPainter, rect: QtCore.QRectF):
-        painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
+        self.profiler.begin_frame()
+        self.lod = self.get_lod()
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, self.lod == LOD_FULL)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, self.lod == LOD_FULL)
         painter.resetTransform()
         painter.fillRect(0, 0, self.size().width(), self.size().height(), QtGui.QColor('darkGray'))
         global_transform = QtGui.QTransform()
         global_transform.translate(self.offsetX, self.offsetY)
         painter.setTransform(global_transform, False)
+        self.tile_cache.set_zoom(self.sc)
+        self.object_cache.set_zoom(self.sc)
+        self.view_rect = QtCore.QRectF(-self.offsetX, -self.offsetY, self.size().width(), self.size().height())
+        self.drawn_items = self.culled_items = 0
 
         # Draw tile layer
         tile_layer = self.map.get_tile_layer()
         if tile_layer and tile_layer.visible:
-            self.draw_tiles(tile_layer.data, painter, global_transform)
+            self.draw_tiles(painter)
         # Draw layer w/ objects
         self.draw_objects(painter)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Painted items: {}; culled items: {}".format(self.drawn_items, self.culled_items))
 
         painter.resetTransform()
         painter.setPen(QtGui.QColor('black'))
         if self.lmbPressed:
             painter.drawRect(0 + self.mouseStartX, 0 + self.mouseStartY
                              , self.mouseCurX - self.mouseStartX, self.mouseCurY - self.mouseStartY)
+        if not self.first_frame_drawn:
+            self.first_frame_drawn = True
+            self.firstFrameDrawn.emit()
 
-    def draw_tiles(self, layer_data, painter: QtGui.QPainter, global_transform):
-        tiles = self.dm.tiles.only_tiles()
-        for i in range(len(tiles)):
-            for j in range(len(tiles[0])):
-                tile = tiles[i][j]
-                orientation = tile.orientation
-                painter.scale(self.sc, self.sc)
-                painter.translate(tile.i * self.map.gridSize, (len(tiles[0]) - 1 - tile.j) * self.map.gridSize)
-
-                my_transform = QTransform()
-                my_transform.rotate(get_degree_for_orientation(orientation))
-                img = self.tileSprites[tile.type].transformed(my_transform)
-                painter.drawImage(QtCore.QRectF(0, 0, self.map.gridSize, self.map.gridSize),
-                                  img)
-                # print(self.tileSelection)
-                if self.is_selected_tile(tile):
-                    painter.setPen(QtGui.QColor('green'))
-                    painter.drawRect(QtCore.QRectF(1, 1, self.map.gridSize - 1, self.map.gridSize - 1))
+    def drawForeground(self, painter: QtGui.QPainter, rect: QtCore.QRectF):
+        if not self.profiler.enabled:
+            return
+        self.profiler.end_frame()
+        self.update_profiler_counters()
+        self.profiler.draw_hud(painter)
+
+    def update_profiler_counters(self):
+        profiler = self.profiler
+        profiler.set_counter('drawn/culled', '{}/{}'.format(self.drawn_items, self.culled_items))
+        profiler.set_counter('frames', len(get_pose_cache(self.dm).keys))
+        scheduler = self.repaint_scheduler
+        profiler.set_counter('repaints', '{} painted, {} merged of {}'.format(scheduler.flushed, scheduler.merged,
+                                                                             scheduler.requested))
+        profiler.set_counter('chunks', '{} cached, {} rendered'.format(len(self.tile_store),
+                                                                      self.tile_store.rendered_chunks))
+        for name, cache in (('tile cache', self.tile_cache), ('obj cache', self.object_cache)):
+            requests = cache.hits + cache.misses
+            profiler.set_counter(name, '{:.1f}% hit, {} pages'.format(
+                100. * cache.hits / requests if requests else 0., len(cache)))
+
+    def get_lod(self) -> int:
+        """
+        Get level of detail for current zoom
+        :return: LOD_FULL, LOD_MIPMAP or LOD_FLAT
+        """
+        if self.sc < LOD_FLAT_SCALE:
+            return LOD_FLAT
+        if self.sc < LOD_MIPMAP_SCALE:
+            return LOD_MIPMAP
+        return LOD_FULL
+
+    def get_visible_tile_range(self, i_count: int, j_count: int) -> Tuple[range, range]:
+        """
+        Get ranges of tile indexes, that intersect visible area of viewer
+        :param i_count: count of tiles along i
+        :param j_count: count of tiles along j
+        :return: (range of i, range of j)
+        """
+        tile_size = self.map.gridSize * self.sc
+        i_min = max(0, math.floor(self.view_rect.left() / tile_size))
+        i_max = min(i_count, math.ceil(self.view_rect.right() / tile_size))
+        # rows are drawn top-down, so j is flipped
+        row_min = max(0, math.floor(self.view_rect.top() / tile_size))
+        row_max = min(j_count, math.ceil(self.view_rect.bottom() / tile_size))
+        return range(i_min, max(i_min, i_max)), range(max(0, j_count - row_max), max(0, j_count - row_min))
+
+    def is_visible_rect(self, rect: QtCore.QRectF) -> bool:
+        """
+        Check that rect (in coordinates of the global transform) intersects visible area.
+        Updates counters of drawn/culled items
+        :param rect: bounds of item
+        :return: bool
+        """
+        if self.view_rect.intersects(rect):
+            self.drawn_items += 1
+            return True
+        self.culled_items += 1
+        return False
+
+    @profiled('tiles')
+    def draw_tiles(self, painter: QtGui.QPainter):
+        tiles = self.get_tile_grid()
+        tile_size = self.map.gridSize * self.sc
+        i_range, j_range = self.get_visible_tile_range(self.grid_width, self.grid_height)
+        self.drawn_items += len(i_range) * len(j_range)
+        self.culled_items += self.grid_width * self.grid_height - len(i_range) * len(j_range)
+        if not self.tile_store.draw(painter, tiles, tile_size, self.view_rect, self.lod, self.lod == LOD_FULL):
+            self.draw_tile_block(painter, tiles, i_range, j_range, QtCore.QPointF(
+                i_range.start * tile_size, (self.grid_height - j_range.stop) * tile_size), tile_size)
+        # selection isn't a part of chunks, draw it over tiles
+        if not self.draw_selection:
+            return
+        batch = SpriteBatch()
+        green = QtGui.QColor('green')
+        for i in range(max(i_range.start, self.tileSelection[0]), min(i_range.stop, self.tileSelection[2] + 1)):
+            for j in range(max(j_range.start, self.tileSelection[3]), min(j_range.stop, self.tileSelection[1] + 1)):
+                batch.add_outline(QtCore.QRectF(i * tile_size, (self.grid_height - 1 - j) * tile_size,
+                                                tile_size, tile_size).adjusted(self.sc, self.sc, 0, 0), green, self.sc)
+        batch.flush(painter)
+
+    def draw_tile_block(self, painter: QtGui.QPainter, tiles, i_range: range, j_range: range,
+                        origin: QtCore.QPointF, tile_size: float):
+        """
+        Draw rectangular block of tiles w/ one batch: sprites (or flat colours), grid lines and mark of origin
+        :param painter: painter
+        :param tiles: tiles as 2d-list [i][j]
+        :param i_range: range of i
+        :param j_range: range of j
+        :param origin: top left corner of block (tile w/ i_range.start, j_range.stop - 1)
+        :param tile_size: side of tile, pixels
+        :return: -
+        """
+        if not len(i_range) or not len(j_range):
+            return
+        batch = SpriteBatch()
+        line_width = tile_size / self.map.gridSize
+        top = origin.y() + (j_range.stop - 1) * tile_size
+        for i in i_range:
+            column = tiles[i]
+            x = origin.x() + (i - i_range.start) * tile_size
+            for j in j_range:
+                tile = column[j]
+                rect = QtCore.QRectF(x, top - j * tile_size, tile_size, tile_size)
+                if self.lod == LOD_FLAT:
+                    batch.add_fill(rect, self.tile_cache.get_color(tile.type))
                 else:
-                    painter.setPen(QtGui.QColor('white'))
-                    painter.drawRect(QtCore.QRectF(0, 0, self.map.gridSize, self.map.gridSize))
-                if tile.j == 0 and tile.i == 0:
-                    painter.setPen(QtGui.QColor('blue'))
-                    painter.drawRect(QtCore.QRectF(1, 1, self.map.gridSize - 1, self.map.gridSize - 1))
-                painter.setTransform(global_transform, False)
+                    pixmap, source = self.tile_cache.get(tile.type, tile_size)
+                    batch.add_pixmap(pixmap, rect, get_degree_for_orientation(tile.orientation), source)
+        if self.lod != LOD_FLAT:
+            batch.add_grid(QtCore.QRectF(origin.x(), origin.y(), len(i_range) * tile_size, len(j_range) * tile_size),
+                           len(i_range), len(j_range), QtGui.QColor('white'), line_width)
+        if 0 in i_range and 0 in j_range:
+            rect = QtCore.QRectF(origin.x() - i_range.start * tile_size, top, tile_size, tile_size)
+            batch.add_outline(rect.adjusted(line_width, line_width, 0, 0), QtGui.QColor('blue'), line_width)
+        batch.flush(painter)
 
     def is_selected_tile(self, tile: _Tile) -> bool:
         return self.tileSelection[0] <= tile.i <= self.tileSelection[2] and self.tileSelection[3] <= tile.j <= \
@@ -255,78 +645,78 @@ class MapViewer(QGraphicsView, QtWidgets.QWidget):
 
     def draw_objects(self, painter):
         width, height = self.map.gridSize * self.sc / 2, self.map.gridSize * self.sc / 2
-        self.draw_watchtowers(width, height, painter)
-        self.draw_citizens(width, height, painter)
-        self.draw_traffic_signs(width, height, painter)
-        self.draw_groundtags(width, height, painter)
-        self.draw_vehicles(width, height, painter)
-        self.draw_decorations(width, height, painter)
-
-    def draw_decorations(self, width, height, painter):
+        # passes only collect sprites, they are drawn at once
+        batch = SpriteBatch()
+        self.draw_watchtowers(width, height, batch)
+        self.draw_citizens(width, height, batch)
+        self.draw_traffic_signs(width, height, batch)
+        self.draw_groundtags(width, height, batch)
+        self.draw_vehicles(width, height, batch)
+        self.draw_decorations(width, height, batch)
+        self.flush_objects(batch, painter)
+
+    @profiled('object blit')
+    def flush_objects(self, batch: SpriteBatch, painter: QtGui.QPainter):
+        batch.flush(painter)
+
+    @profiled('decorations')
+    def draw_decorations(self, width, height, batch):
         if self.dm.decorations:
-            self.raw_draw_objects(width, height, painter, self.dm.decorations)
+            self.raw_draw_objects(width, height, batch, self.dm.decorations)
 
-    def draw_citizens(self, width, height, painter):
-        self.raw_draw_objects(width, height, painter, self.dm.citizens, "duckie")
+    @profiled('citizens')
+    def draw_citizens(self, width, height, batch):
+        self.raw_draw_objects(width, height, batch, self.dm.citizens, "duckie")
 
-    def draw_watchtowers(self, width, height, painter):
+    @profiled('watchtowers')
+    def draw_watchtowers(self, width, height, batch):
         if self.dm.watchtowers is not None:
-            self.raw_draw_objects(width, height, painter, self.dm.watchtowers, "watchtower")
+            self.raw_draw_objects(width, height, batch, self.dm.watchtowers, "watchtower")
 
-    def draw_traffic_signs(self, width, height, painter):
+    @profiled('signs')
+    def draw_traffic_signs(self, width, height, batch):
+        poses = get_pose_cache(self.dm)
         for info, object in self.dm.traffic_signs:
             obj_name, obj_type = info
-            frame_obj = self.dm.frames[obj_name]
-            x, y = 0, 0
-            frame_of_pose = frame_obj
-            yaw = - np.rad2deg(frame_obj.pose.yaw)
-            while frame_of_pose:
-                x += frame_of_pose.pose.x
-                y += frame_of_pose.pose.y
-                frame_of_pose = self.dm.frames[frame_of_pose.relative_to]
-            x, y = self.get_x_to_view(x), self.get_y_to_view(y)
-            draw_obj = QtCore.QRectF(x - width / 2,
-                                     y - height / 2,
-                                     width, height)
-            tf = QTransform()
-            tf.rotate(yaw)
-            print(f"Rotate {yaw}")
-            print(self.objects)
-            img: QtGui.QImage = self.objects[object.type].transformed(tf)
-            painter.drawImage(
-                draw_obj,
-                img)
-
-    def draw_groundtags(self, width, height, painter):
-        self.raw_draw_objects(width, height, painter, self.dm.ground_tags, "apriltag")
-
-    def draw_vehicles(self, width, height, painter):
+            x, y, yaw = poses.get(obj_name)
+            yaw = - np.rad2deg(yaw)
+            self.draw_object(batch, object.type, self.get_x_to_view(x), self.get_y_to_view(y), yaw, width)
+
+    @profiled('ground tags')
+    def draw_groundtags(self, width, height, batch):
+        self.raw_draw_objects(width, height, batch, self.dm.ground_tags, "apriltag")
+
+    @profiled('vehicles')
+    def draw_vehicles(self, width, height, batch):
         if self.dm.vehicles:
-            self.raw_draw_objects(width, height, painter, self.dm.vehicles, "duckiebot")
+            self.raw_draw_objects(width, height, batch, self.dm.vehicles, "duckiebot")
 
-    def raw_draw_objects(self, width, height, painter, arr_objects, type_name=None):
+    def raw_draw_objects(self, width, height, batch, arr_objects, type_name=None):
+        poses = get_pose_cache(self.dm)
         for info, obj in arr_objects:
             obj_name, obj_type = info
-            frame_obj = self.dm.frames[obj_name]
-            print('OBJ ', obj)
-            x, y = 0, 0
-            frame_of_pose = frame_obj
-            yaw = - (np.rad2deg(frame_obj.pose.yaw) )
-            while frame_of_pose:
-                x += frame_of_pose.pose.x
-                y += frame_of_pose.pose.y
-                frame_of_pose = self.dm.frames[frame_of_pose.relative_to]
-            x, y = self.get_x_to_view(x), self.get_y_to_view(y)
-            draw_obj = QtCore.QRectF(x - width / 2,
-                              y - height / 2,
-                              width, height)
-            tf = QTransform()
-            tf.rotate(yaw)
-            print(f"Rotate {yaw}")
-            if type_name is not None:
-                img: QtGui.QImage = self.objects[type_name].transformed(tf)
-            else:
-                img: QtGui.QImage = self.objects[obj.type].transformed(tf)
-            painter.drawImage(
-                draw_obj,
-                img)
+            x, y, yaw = poses.get(obj_name)
+            yaw = - np.rad2deg(yaw)
+            self.draw_object(batch, type_name if type_name is not None else obj.type,
+                             self.get_x_to_view(x), self.get_y_to_view(y), yaw, width)
+
+    def draw_object(self, batch: SpriteBatch, sprite_name: str, x: float, y: float, yaw: float, size: float):
+        """
+        Add sprite of object centered at (x, y) to batch w/ respect to level of detail
+        :param batch: batch of object layer
+        :param sprite_name: name of sprite
+        :param x: x in view
+        :param y: y in view
+        :param yaw: rotation in degrees
+        :param size: side of sprite, pixels
+        :return: -
+        """
+        draw_obj = QtCore.QRectF(x - size / 2, y - size / 2, size, size)
+        if not self.is_visible_rect(draw_obj):
+            return
+        if self.lod == LOD_FLAT:
+            dot = max(2., size / 2)
+            batch.add_fill(QtCore.QRectF(x - dot / 2, y - dot / 2, dot, dot), self.object_cache.get_color(sprite_name))
+        else:
+            pixmap, source = self.object_cache.get(sprite_name, size)
+            batch.add_pixmap(pixmap, draw_obj, yaw, source)
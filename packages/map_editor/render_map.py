@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Render duckietown_world maps to PNG w/o display (thumbnails for CI, catalogs of maps).
+
+python3 render_map.py maps/tm1 maps/empty -o thumbnails --size 1024x768 --jobs 4
+"""
+import os
+
+# must be set before creating of QApplication
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import logging
+import multiprocessing
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+from PyQt5 import QtWidgets
+
+from logger import init_logger
+
+logger = logging.getLogger('root')
+
+EDITOR_DIR = os.path.dirname(os.path.abspath(__file__))  # sprites are loaded relative to it
+DEFAULT_SIZE = (1024, 1024)
+
+_app = None
+_viewer = None
+
+
+def _get_viewer(dm):
+    """
+    Get viewer of this process, it's created once, so sprites are loaded once per process
+    :param dm: dt-world map to show
+    :return: MapViewer
+    """
+    global _app, _viewer
+    if _viewer is None:
+        os.chdir(EDITOR_DIR)
+        from map import DuckietownMap
+        from mapviewer import MapViewer
+        _app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+        _viewer = MapViewer(dm=dm)
+        _viewer.setMap(DuckietownMap())
+        _viewer.draw_selection = False
+    else:
+        _viewer.dm = dm
+        _viewer.invalidate_tiles()
+    return _viewer
+
+
+def render_map(map_dir: str, output: str, width: int = DEFAULT_SIZE[0], height: int = DEFAULT_SIZE[1],
+               zoom: Optional[float] = None) -> str:
+    """
+    Render map to PNG
+    :param map_dir: directory of map in duckietown_world format
+    :param output: path of PNG file
+    :param width: width of image, pixels
+    :param height: height of image, pixels
+    :param zoom: zoom of viewer (1 - 58.5 pixels per tile); if None, the whole map fits the image
+    :return: absolute path of PNG file
+    """
+    # paths are resolved before viewer changes working dir
+    map_dir, output = os.path.abspath(map_dir), os.path.abspath(output)
+    from DTWorld import get_new_dt_world
+    dm = get_new_dt_world(map_dir)
+    viewer = _get_viewer(dm)
+    viewer.fit_to_size(width, height, zoom)
+    image = viewer.render_image(width, height)
+    if not image.save(output, 'PNG'):
+        raise IOError("Can't save image to '{}'".format(output))
+    return output
+
+
+def _render_task(args: Tuple) -> str:
+    return render_map(*args)
+
+
+def render_maps(map_dirs: List[str], output_dir: str, width: int = DEFAULT_SIZE[0], height: int = DEFAULT_SIZE[1],
+                zoom: Optional[float] = None, jobs: Optional[int] = None) -> int:
+    """
+    Render maps in parallel, each map is rendered to <output_dir>/<name of map>.png
+    :param jobs: count of processes, if None - count of CPUs
+    :return: count of failed maps
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = {}
+    for map_dir in map_dirs:
+        name = os.path.basename(os.path.normpath(map_dir))
+        tasks[map_dir] = (os.path.abspath(map_dir), os.path.abspath(os.path.join(output_dir, name + '.png')),
+                          width, height, zoom)
+    failed = 0
+    # Qt doesn't survive fork, so workers are spawned
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(_render_task, task): map_dir for map_dir, task in tasks.items()}
+        for future in as_completed(futures):
+            try:
+                logger.info("{} -> {}".format(futures[future], future.result()))
+            except Exception as e:
+                failed += 1
+                logger.error("Can't render {}: {}".format(futures[future], e))
+    return failed
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition('x')
+    return int(width), int(height or width)
+
+
+if __name__ == '__main__':
+    init_logger().setLevel(logging.INFO)
+    parser = ArgumentParser(description="Render duckietown_world maps to PNG w/o display")
+    parser.add_argument('maps', nargs='+', help="Directories of maps")
+    parser.add_argument('-o', '--output', default='.', help="Directory for PNG files")
+    parser.add_argument('-s', '--size', type=parse_size, default=DEFAULT_SIZE, help="Size of image, WIDTHxHEIGHT")
+    parser.add_argument('-z', '--zoom', type=float, default=None,
+                        help="Zoom (1 - 58.5 pixels per tile), by default the whole map fits the image")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Count of processes, by default count of CPUs")
+
+    args = parser.parse_args()
+    sys.exit(1 if render_maps(args.maps, args.output, args.size[0], args.size[1], args.zoom, args.jobs) else 0)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import functools
+import time
+from collections import OrderedDict
+from typing import List
+
+from PyQt5 import QtCore, QtGui
+
+SMOOTHING = 0.1  # weight of the last frame in moving averages
+HUD_MARGIN = 6
+
+
+def profiled(section_name: str):
+    """
+    Decorator for paint methods of viewer: time spent in method is added to section of viewer's profiler.
+    Method is called as is, if profiler is disabled
+    :param section_name: name of section in HUD
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.add_time(section_name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class RenderProfiler:
+    """
+    Collects frame time, FPS, time per paint section and arbitrary counters of viewer
+    and draws them as overlay (HUD)
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.frame_time = 0.  # ms, moving average
+        self.fps = 0.
+        self.sections = OrderedDict()  # section name -> ms, moving average
+        self.counters = OrderedDict()  # counter name -> str
+        self._frame_start = None
+        self._last_frame_start = None
+        self._frame_sections = {}
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._last_frame_start is not None:
+            interval = now - self._last_frame_start
+            if interval > 0:
+                self.fps = self._smooth(self.fps, 1. / interval)
+        self._last_frame_start = self._frame_start = now
+        self._frame_sections = {}
+
+    def end_frame(self):
+        if not self.enabled or self._frame_start is None:
+            return
+        self.frame_time = self._smooth(self.frame_time, (time.perf_counter() - self._frame_start) * 1000)
+        for name in list(self.sections) + [name for name in self._frame_sections if name not in self.sections]:
+            self.sections[name] = self._smooth(self.sections.get(name, 0.), self._frame_sections.get(name, 0.))
+        self._frame_start = None
+
+    def add_time(self, section_name: str, seconds: float):
+        self._frame_sections[section_name] = self._frame_sections.get(section_name, 0.) + seconds * 1000
+
+    def set_counter(self, name: str, value):
+        self.counters[name] = value
+
+    def lines(self) -> List[str]:
+        lines = ["frame: {:.2f} ms  fps: {:.1f}".format(self.frame_time, self.fps)]
+        lines.extend("{:<12} {:7.2f} ms".format(name, value) for name, value in self.sections.items())
+        lines.extend("{:<12} {}".format(name, value) for name, value in self.counters.items())
+        return lines
+
+    def draw_hud(self, painter: QtGui.QPainter):
+        """
+        Draw overlay in the top left corner of viewport
+        :param painter: painter w/o transformations
+        :return: -
+        """
+        if not self.enabled:
+            return
+        painter.save()
+        painter.resetTransform()
+        font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+        painter.setFont(font)
+        metrics = QtGui.QFontMetrics(font)
+        lines = self.lines()
+        width = max(metrics.horizontalAdvance(line) for line in lines) + 2 * HUD_MARGIN
+        height = metrics.lineSpacing() * len(lines) + 2 * HUD_MARGIN
+        painter.fillRect(QtCore.QRectF(0, 0, width, height), QtGui.QColor(0, 0, 0, 160))
+        painter.setPen(QtGui.QColor('white'))
+        for row, line in enumerate(lines):
+            painter.drawText(HUD_MARGIN, HUD_MARGIN + metrics.ascent() + row * metrics.lineSpacing(), line)
+        painter.restore()
+
+    @staticmethod
+    def _smooth(average: float, value: float) -> float:
+        return value if not average else average + SMOOTHING * (value - average)
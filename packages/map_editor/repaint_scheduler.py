@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import time
+from typing import Optional
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+DEFAULT_REFRESH_RATE = 60.  # Hz, if refresh rate of screen is unknown
+
+
+class RepaintScheduler(QtCore.QObject):
+    """
+    Merges repaint requests of widget into at most one update per display refresh.
+    Dirty rectangles of merged requests are united, request w/o rect repaints the whole widget
+    """
+
+    def __init__(self, widget: QtWidgets.QWidget, refresh_rate: Optional[float] = None):
+        """
+        :param widget: widget to update (viewport of view)
+        :param refresh_rate: max count of updates per second; if None, refresh rate of primary screen
+        """
+        QtCore.QObject.__init__(self, widget)
+        self.widget = widget
+        if refresh_rate is None:
+            screen = QtGui.QGuiApplication.primaryScreen()
+            refresh_rate = screen.refreshRate() if screen and screen.refreshRate() > 0 else DEFAULT_REFRESH_RATE
+        self.interval = 1. / refresh_rate  # s
+        self.requested = 0  # count of requests
+        self.merged = 0  # count of requests merged into already scheduled update
+        self.flushed = 0  # count of updates
+        self._dirty: Optional[QtCore.QRect] = None
+        self._full = False
+        self._last_flush = 0.
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def pending(self) -> bool:
+        return self._timer.isActive()
+
+    def request(self, rect: Optional[QtCore.QRectF] = None):
+        """
+        Schedule repaint
+        :param rect: dirty rect in widget coordinates; if None, the whole widget
+        :return: -
+        """
+        self.requested += 1
+        if rect is None:
+            self._full = True
+        elif not self._full:
+            rect = rect.toAlignedRect()
+            self._dirty = rect if self._dirty is None else self._dirty.united(rect)
+        if self._timer.isActive():
+            self.merged += 1
+            return
+        delay = self._last_flush + self.interval - time.perf_counter()
+        self._timer.start(max(0, int(delay * 1000)))
+
+    def flush(self):
+        """
+        Update dirty area now
+        :return: -
+        """
+        self._timer.stop()
+        if self._full:
+            self.widget.update()
+        elif self._dirty is not None:
+            self.widget.update(self._dirty)
+        else:
+            return
+        self.flushed += 1
+        self._last_flush = time.perf_counter()
+        self._dirty = None
+        self._full = False
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from typing import Hashable, Iterable, List, Set, Tuple
+
+from spatial_index import SpatialGrid
+
+SELECTION_CELL_SIZE = 1.  # objects of legacy layers are positioned in tiles
+
+
+class SelectionModel:
+    """
+    Selected objects of object layers of DuckietownMap as set of keys (layer type, object id).
+    Objects are kept in spatial index, so selection by rectangle visits only cells of rectangle.
+    Index is rebuilt only after objects were added or removed (see MapLayer.revision)
+    """
+
+    def __init__(self, dt_map=None):
+        self.map = dt_map
+        self.selected: Set[Tuple[Hashable, int]] = set()
+        self._index = SpatialGrid(SELECTION_CELL_SIZE)
+        self._index_state = None
+        self._rect = None
+
+    def __len__(self):
+        return len(self.selected)
+
+    def __bool__(self):
+        return bool(self.selected)
+
+    def set_map(self, dt_map):
+        self.map = dt_map
+        self.clear()
+        self._index_state = None
+
+    def clear(self):
+        self.selected.clear()
+        self._rect = None
+
+    def select_rect(self, rect: Tuple[float, float, float, float]) -> bool:
+        """
+        Add objects strictly inside rectangle to selection; nothing is done if rectangle isn't changed
+        :param rect: [x_min, y_min, x_max, y_max] in map coordinates
+        :return: bool, True if new objects were selected
+        """
+        rect = tuple(rect)
+        index_changed = self._update_index()
+        if rect == self._rect and not index_changed:
+            return False
+        self._rect = rect
+        x_min, y_min, x_max, y_max = rect
+        new_keys = []
+        for key in self._index.query_rect(x_min, y_min, x_max, y_max):
+            x, y = self._index.position(key)
+            if key not in self.selected and x_min < x < x_max and y_min < y < y_max:
+                new_keys.append(key)
+        self.selected.update(new_keys)
+        return bool(new_keys)
+
+    def get_items(self) -> List:
+        """
+        Get selected objects, objects, which were removed from map, are skipped
+        :return: list of objects
+        """
+        items = []
+        for key in self.selected:
+            item = self._get_item(key)
+            if item is not None:
+                items.append(item)
+        return items
+
+    def objects_moved(self, objects: Iterable):
+        """
+        Update places of objects, which were moved outside of selection (e.g. by undo)
+        :param objects: objects of object layers
+        :return: -
+        """
+        if self._update_index():
+            return
+        layers = list(self.map.get_object_layers()) if self.map is not None else []
+        for obj in objects:
+            for layer in layers:
+                obj_id = layer.get_id(obj)
+                if obj_id is not None:
+                    self._index.move((layer.type, obj_id), *obj.position)
+                    break
+
+    def move_selected(self, dx: float, dy: float):
+        """
+        Move selected objects and update their places in index
+        :return: -
+        """
+        self._update_index()
+        for key in self.selected:
+            item = self._get_item(key)
+            if item is not None:
+                item.position[0] += dx
+                item.position[1] += dy
+                self._index.move(key, *item.position)
+
+    def _get_item(self, key: Tuple[Hashable, int]):
+        layer = self.map.get_layer_by_type(key[0]) if self.map is not None else None
+        return layer.get_object(key[1]) if layer is not None else None
+
+    def _update_index(self) -> bool:
+        """
+        Rebuild index, if objects of map were changed since last build
+        :return: bool, True if index was rebuilt
+        """
+        layers = list(self.map.get_object_layers()) if self.map is not None else []
+        state = [(id(layer), layer.revision) for layer in layers]
+        if state == self._index_state:
+            return False
+        self._index.build(((layer.type, obj_id), *layer.get_object(obj_id).position)
+                          for layer in layers for obj_id in layer.get_ids())
+        self._index_state = state
+        return True
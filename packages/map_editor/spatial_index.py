@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+DEFAULT_CELL_SIZE = 0.585  # size of tile
+
+
+class SpatialGrid:
+    """
+    Uniform grid over 2d points, keyed by any hashable key.
+    Insert/move/remove are O(1), nearest and rectangle queries visit only cells around the query
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]] = defaultdict(dict)
+        self._cell_of: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self):
+        return len(self._cell_of)
+
+    def __contains__(self, key):
+        return key in self._cell_of
+
+    def clear(self):
+        self._cells.clear()
+        self._cell_of.clear()
+
+    def build(self, items: Iterable[Tuple[Hashable, float, float]]):
+        """
+        Fill index from scratch
+        :param items: iterable of (key, x, y)
+        :return: -
+        """
+        self.clear()
+        for key, x, y in items:
+            self.insert(key, x, y)
+
+    def insert(self, key: Hashable, x: float, y: float):
+        """
+        Add point to index or move it, if key already exists
+        :return: -
+        """
+        cell = self._cell(x, y)
+        old_cell = self._cell_of.get(key)
+        if old_cell is not None and old_cell != cell:
+            self._discard(key, old_cell)
+        self._cells[cell][key] = (x, y)
+        self._cell_of[key] = cell
+
+    move = insert
+
+    def remove(self, key: Hashable):
+        cell = self._cell_of.pop(key, None)
+        if cell is not None:
+            self._discard(key, cell)
+
+    def position(self, key: Hashable) -> Optional[Tuple[float, float]]:
+        cell = self._cell_of.get(key)
+        return None if cell is None else self._cells[cell][key]
+
+    def nearest(self, x: float, y: float, radius: float) -> Optional[Hashable]:
+        """
+        Find the nearest point within radius
+        :return: key of point or None
+        """
+        best_key, best_distance = None, radius
+        for key, (px, py) in self._items_in_cells(x - radius, y - radius, x + radius, y + radius):
+            distance = math.hypot(px - x, py - y)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def query_rect(self, x_min: float, y_min: float, x_max: float, y_max: float) -> List[Hashable]:
+        """
+        Find points inside rectangle (borders are included)
+        :return: list of keys
+        """
+        x_min, x_max = min(x_min, x_max), max(x_min, x_max)
+        y_min, y_max = min(y_min, y_max), max(y_min, y_max)
+        return [key for key, (px, py) in self._items_in_cells(x_min, y_min, x_max, y_max)
+                if x_min <= px <= x_max and y_min <= py <= y_max]
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def _discard(self, key, cell):
+        points = self._cells[cell]
+        del points[key]
+        if not points:
+            del self._cells[cell]
+
+    def _items_in_cells(self, x_min, y_min, x_max, y_max):
+        (cx_min, cy_min), (cx_max, cy_max) = self._cell(x_min, y_min), self._cell(x_max, y_max)
+        if (cx_max - cx_min + 1) * (cy_max - cy_min + 1) > len(self._cells):
+            # query covers more cells than occupied, check only occupied ones
+            cells = [cell for cell in self._cells if cx_min <= cell[0] <= cx_max and cy_min <= cell[1] <= cy_max]
+        else:
+            cells = [(cx, cy) for cx in range(cx_min, cx_max + 1) for cy in range(cy_min, cy_max + 1)
+                     if (cx, cy) in self._cells]
+        for cell in cells:
+            yield from self._cells[cell].items()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from PyQt5 import QtCore, QtGui
+
+
+class SpriteBatch:
+    """
+    Collects sprites, filled rects and lines of one paint pass and draws them w/ a few Qt calls:
+    one drawPixmapFragments per run of sprites from the same pixmap (atlas), one drawRects per colour
+    and one drawLines per pen.
+    Fills are drawn first, then sprites, then lines. Sprites keep order of adding (a new run starts,
+    when pixmap changes), so overlapping sprites of different pixmaps keep their z-order
+    """
+
+    def __init__(self):
+        self._fragments: List[Tuple[int, QtGui.QPixmap, List]] = []  # runs of (cacheKey, pixmap, fragments)
+        self._fills: Dict[int, Tuple[QtGui.QColor, List[QtCore.QRectF]]] = OrderedDict()  # rgba -> (colour, rects)
+        self._lines: Dict[Tuple[int, float], List[QtCore.QLineF]] = OrderedDict()  # (rgba, width) -> lines
+
+    def __len__(self):
+        return sum(len(fragments) for _, _, fragments in self._fragments) + \
+               sum(len(rects) for _, rects in self._fills.values()) + sum(len(lines) for lines in self._lines.values())
+
+    def add_pixmap(self, pixmap: QtGui.QPixmap, rect: QtCore.QRectF, rotation: float = 0.,
+                   source: QtCore.QRectF = None):
+        """
+        Add sprite, scaled to rect and rotated around center of rect
+        :param pixmap: pixmap or atlas, consecutive sprites of the same pixmap are drawn w/ one call
+        :param rect: target rect (before rotation)
+        :param rotation: rotation in degrees (clockwise, as QPainter.rotate)
+        :param source: part of pixmap to draw, the whole pixmap if None
+        :return: -
+        """
+        if source is None:
+            source = QtCore.QRectF(pixmap.rect())
+        if pixmap.isNull() or source.isEmpty():
+            # sprite wasn't decoded, nothing to draw
+            return
+        fragment = QtGui.QPainter.PixmapFragment.create(rect.center(), source,
+                                                        rect.width() / source.width(),
+                                                        rect.height() / source.height(), rotation)
+        key = pixmap.cacheKey()
+        if not self._fragments or self._fragments[-1][0] != key:
+            self._fragments.append((key, pixmap, []))
+        self._fragments[-1][2].append(fragment)
+
+    def add_fill(self, rect: QtCore.QRectF, color: QtGui.QColor):
+        key = color.rgba()
+        if key not in self._fills:
+            self._fills[key] = (color, [])
+        self._fills[key][1].append(rect)
+
+    def add_line(self, line: QtCore.QLineF, color: QtGui.QColor, width: float):
+        self._lines.setdefault((color.rgba(), width), []).append(line)
+
+    def add_outline(self, rect: QtCore.QRectF, color: QtGui.QColor, width: float):
+        self._lines.setdefault((color.rgba(), width), []).extend((
+            QtCore.QLineF(rect.topLeft(), rect.topRight()), QtCore.QLineF(rect.topRight(), rect.bottomRight()),
+            QtCore.QLineF(rect.bottomRight(), rect.bottomLeft()), QtCore.QLineF(rect.bottomLeft(), rect.topLeft())))
+
+    def add_grid(self, rect: QtCore.QRectF, columns: int, rows: int, color: QtGui.QColor, width: float):
+        """
+        Add borders of columns x rows equal cells, that fill rect
+        :return: -
+        """
+        lines = self._lines.setdefault((color.rgba(), width), [])
+        for column in range(columns + 1):
+            x = rect.left() + rect.width() * column / columns
+            lines.append(QtCore.QLineF(x, rect.top(), x, rect.bottom()))
+        for row in range(rows + 1):
+            y = rect.top() + rect.height() * row / rows
+            lines.append(QtCore.QLineF(rect.left(), y, rect.right(), y))
+
+    def clear(self):
+        self._fragments.clear()
+        self._fills.clear()
+        self._lines.clear()
+
+    def flush(self, painter: QtGui.QPainter) -> int:
+        """
+        Draw collected items and clear batch
+        :param painter: painter
+        :return: count of draw calls
+        """
+        calls = 0
+        painter.save()
+        painter.setPen(QtCore.Qt.NoPen)
+        for color, rects in self._fills.values():
+            painter.setBrush(color)
+            painter.drawRects(rects)
+            calls += 1
+        for _, pixmap, fragments in self._fragments:
+            painter.drawPixmapFragments(fragments, pixmap)
+            calls += 1
+        painter.setBrush(QtCore.Qt.NoBrush)
+        for (rgba, width), lines in self._lines.items():
+            painter.setPen(QtGui.QPen(QtGui.QColor.fromRgba(rgba), width))
+            painter.drawLines(lines)
+            calls += 1
+        painter.restore()
+        self.clear()
+        return calls
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from PyQt5 import QtCore, QtGui
+
+from utils import get_list_dir_with_path
+
+logger = logging.getLogger('root')
+
+LOADER_THREADS = min(8, os.cpu_count() or 1)
+ATLAS_MANIFEST_VERSION = 2
+
+TILES_DIR_PATH = './img/tiles'
+OBJECT_DIR_PATHS = ['./img/signs',
+                    './img/apriltags',
+                    './img/objects']
+ATLAS_MANIFEST_PATH = './img/atlas/atlas.json'  # written by build_atlas.py, directories are used w/o it
+ATLAS_GROUP_TILES = 'tiles'
+ATLAS_GROUP_OBJECTS = 'objects'
+ATLAS_GROUPS = {ATLAS_GROUP_TILES: [TILES_DIR_PATH], ATLAS_GROUP_OBJECTS: OBJECT_DIR_PATHS}
+
+
+class SpriteLibrary:
+    """
+    Read-only mapping sprite name -> QImage, which decodes images lazily.
+    Sprite is either a separate file or a rect of atlas image (see build_atlas.py), so a few atlas files can
+    replace hundreds of small ones.
+    Files are decoded in thread pool (QImage doesn't need GUI thread): `preload` waits for given sprites,
+    `load_in_background` schedules the rest; file, which isn't decoded yet, is decoded on first access
+    """
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        """
+        :param executor: thread pool for decoding, shared pool of module if None
+        """
+        self._executor = executor
+        self._sources: Dict[str, Tuple[str, Optional[QtCore.QRect]]] = {}  # name -> (file, rect in file)
+        self._images: Dict[str, QtGui.QImage] = {}
+        self._files: Dict[str, QtGui.QImage] = {}  # decoded atlases
+        self._futures: Dict[str, Future] = {}  # file -> Future of QImage
+
+    def add_dir(self, dir_path: str, get_name: Callable[[str], str] = lambda name: name):
+        """
+        Register all images of directory, name of sprite is name of file w/o extension
+        :param dir_path: directory w/ images
+        :param get_name: function, that converts name of file to name of sprite
+        :return: -
+        """
+        for filename, file_path in get_list_dir_with_path(dir_path):
+            self.add_path(get_name(filename.split('.')[0]), file_path)
+
+    def add_path(self, name: str, file_path: str, rect: Optional[QtCore.QRect] = None):
+        """
+        Register sprite
+        :param name: name of sprite
+        :param file_path: image file
+        :param rect: part of image, if file is atlas
+        :return: -
+        """
+        self._sources[name] = (file_path, rect)
+        self._images.pop(name, None)
+
+    def add_atlas(self, manifest_path: str, group: str, source_dirs: Iterable[str],
+                  get_name: Callable[[str], str] = lambda name: name) -> bool:
+        """
+        Register sprites of group from atlas manifest
+        :param manifest_path: JSON manifest written by build_atlas.py
+        :param group: group of sprites in manifest
+        :param source_dirs: directories, from which group was built; atlas is stale, if files were added to,
+        removed from or resized in one of them after build (no file is read, see is_same_dir)
+        :param get_name: function, that converts name of file to name of sprite, as for add_dir
+        :return: bool, False if manifest is missing, stale or invalid (nothing is registered)
+        """
+        if not os.path.isfile(manifest_path):
+            return False
+        source_dirs = list(source_dirs)
+        try:
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            if manifest['version'] != ATLAS_MANIFEST_VERSION:
+                raise ValueError("unsupported version {}".format(manifest['version']))
+            base_dir = os.path.dirname(manifest_path)
+            atlases = [os.path.join(base_dir, atlas) for atlas in manifest['atlases']]
+            sources = manifest['groups'][group]
+            if sorted(sources) != sorted(source_dirs) or \
+                    not all(is_same_dir(dir_path, sources[dir_path]) for dir_path in source_dirs):
+                logger.warning("Atlas '{}' doesn't match sprites, rebuild it".format(manifest_path))
+                return False
+            sprites = [(filename, atlases[sprite['atlas']], QtCore.QRect(*sprite['rect']))
+                       for dir_path in source_dirs for filename, sprite in sorted(sources[dir_path].items())
+                       if 'rect' in sprite]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            logger.warning("Can't read atlas manifest '{}': {}".format(manifest_path, e))
+            return False
+        for filename, atlas, rect in sprites:
+            self.add_path(get_name(filename.split('.')[0]), atlas, rect)
+        return True
+
+    def add_image(self, name: str, image: QtGui.QImage):
+        self._sources.pop(name, None)
+        self._images[name] = image
+
+    def __getitem__(self, name: str) -> QtGui.QImage:
+        image = self._images.get(name)
+        if image is None:
+            if name not in self._sources:
+                raise KeyError(name)
+            file_path, rect = self._sources[name]
+            image = self._load_file(file_path) if rect is None else self._get_atlas(file_path).copy(rect)
+            self._images[name] = image
+        return image
+
+    def get_region(self, name: str) -> Tuple[QtGui.QImage, QtCore.QRect]:
+        """
+        Get page of sprite: atlas for sprite of atlas, image of sprite itself otherwise.
+        Sprites of one page can be drawn w/ one call, so atlas sprites aren't copied out of it
+        :param name: name of sprite
+        :return: (page, rect of sprite in page)
+        """
+        file_path, rect = self._sources.get(name, (None, None))
+        if rect is not None:
+            return self._get_atlas(file_path), rect
+        image = self[name]
+        return image, image.rect()
+
+    def __contains__(self, name) -> bool:
+        return name in self._images or name in self._sources
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._images
+        yield from (name for name in self._sources if name not in self._images)
+
+    def __len__(self):
+        return len(set(self._images) | set(self._sources))
+
+    def get(self, name: str, default=None) -> Optional[QtGui.QImage]:
+        return self[name] if name in self else default
+
+    def preload(self, names: Iterable[str]):
+        """
+        Decode sprites in parallel and wait for them. Unknown names are ignored
+        :param names: names of sprites
+        :return: -
+        """
+        start = time.perf_counter()
+        names = [name for name in set(names) if name in self._sources and name not in self._images]
+        self._submit(self._sources[name][0] for name in names)
+        for name in names:
+            self.get_region(name)
+        logger.debug("Preloaded {} sprites in {:.3f} s".format(len(names), time.perf_counter() - start))
+
+    def load_in_background(self):
+        """
+        Schedule decoding of all sprites, that aren't loaded yet
+        :return: -
+        """
+        self._submit(file_path for name, (file_path, _) in self._sources.items() if name not in self._images)
+
+    def _submit(self, file_paths: Iterable[str]):
+        executor = self._executor or _get_executor()
+        for file_path in file_paths:
+            if file_path not in self._futures and file_path not in self._files:
+                self._futures[file_path] = executor.submit(_decode, file_path)
+
+    def _get_atlas(self, file_path: str) -> QtGui.QImage:
+        atlas = self._files.get(file_path)
+        if atlas is None:
+            atlas = self._files[file_path] = self._load_file(file_path)
+        return atlas
+
+    def _load_file(self, file_path: str) -> QtGui.QImage:
+        future = self._futures.pop(file_path, None)
+        return future.result() if future is not None else _decode(file_path)
+
+
+def list_sprite_files(dir_path: str) -> Iterator[Tuple[str, str]]:
+    """
+    :return: (name of file, path) for regular files of directory
+    """
+    return ((filename, file_path) for filename, file_path in get_list_dir_with_path(dir_path)
+            if os.path.isfile(file_path))
+
+
+def is_same_dir(dir_path: str, files: Dict[str, dict]) -> bool:
+    """
+    Check, that directory has the same files of the same sizes as at build of atlas.
+    It's done at startup, so files aren't read; content is compared by `build_atlas.py --check`
+    :param dir_path: directory of sprites
+    :param files: dict name of file -> {'size': int, 'sha1': str}, as in manifest
+    :return: bool
+    """
+    listed = dict(list_sprite_files(dir_path))
+    return set(listed) == set(files) and \
+        all(os.path.getsize(file_path) == files[filename]['size'] for filename, file_path in listed.items())
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=LOADER_THREADS, thread_name_prefix='sprite-loader')
+    return _executor
+
+
+def _decode(file_path: str) -> QtGui.QImage:
+    image = QtGui.QImage()
+    if not image.load(file_path):
+        logger.warning("Can't load sprite '{}'".format(file_path))
+    return image
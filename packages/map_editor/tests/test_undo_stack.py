@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+
+import numpy as np
+import pytest
+
+from classes.mapTile import MapTile
+from tile_grid import TileGrid
+from undo_stack import AttributesChange, ObjectsMoved, TileBlockChange, TileGridGrow, TileGridResize, UndoCommand, \
+    UndoStack
+
+KINDS = ('straight', 'curve_left', 'asphalt', 'floor', 'empty')
+
+# (memory budget, disk budget): raw commands only; packed and spilled; packed and dropped w/o disk
+BUDGETS = {
+    'raw': (64 * 2 ** 20, 0),
+    'spill': (4 * 2 ** 10, 64 * 2 ** 20),
+    'drop': (4 * 2 ** 10, 0),
+}
+
+
+def snapshot(grid: TileGrid):
+    return np.array(grid.kinds, dtype=object)[grid.kind_codes].tolist(), grid.rotations.tolist()
+
+
+def random_tile(rnd: random.Random) -> MapTile:
+    return MapTile(rnd.choice(KINDS), 90 * rnd.randrange(4))
+
+
+def edit(grid: TileGrid, history: UndoStack, rnd: random.Random):
+    """
+    Apply random change of grid and push its command, as MapEditor does
+    """
+    height, width = grid.shape
+    action = rnd.choice(('fill', 'fill', 'pad', 'crop'))
+    if action == 'fill' and height and width:
+        y_slice = slice(rnd.randrange(height), rnd.randint(1, height))
+        x_slice = slice(rnd.randrange(width), rnd.randint(1, width))
+        if y_slice.start < y_slice.stop and x_slice.start < x_slice.stop:
+            before = grid.copy_block(y_slice, x_slice)
+            grid.fill(y_slice, x_slice, random_tile(rnd))
+            history.push(TileBlockChange(grid, y_slice.start, x_slice.start, before,
+                                         grid.copy_block(y_slice, x_slice)))
+            return
+    if action == 'crop' and height > 2 and width > 2:
+        before = (grid.kind_codes, grid.rotations)
+        grid.crop(slice(rnd.randint(0, 1), height - rnd.randint(0, 1)), slice(rnd.randint(0, 1), width))
+        history.push(TileGridResize(grid, before))
+        return
+    lines = tuple(rnd.randint(0, 3) for _ in range(4))
+    before = (grid.kind_codes, grid.rotations)
+    if grid.pad(*lines, random_tile(rnd)):
+        history.push(TileGridGrow(grid, lines))
+    else:
+        history.push(TileGridResize(grid, before))
+
+
+@pytest.mark.parametrize('budget', sorted(BUDGETS))
+@pytest.mark.parametrize('seed', range(20))
+def test_random_undo_redo_round_trip(budget, seed):
+    rnd = random.Random(seed)
+    height, width = rnd.randint(1, 8), rnd.randint(1, 8)
+    grid = TileGrid.from_tiles([[random_tile(rnd) for _ in range(width)] for _ in range(height)])
+    history = UndoStack(*BUDGETS[budget])
+    # states[i] is grid after i commands, position is the current one
+    states, position = [snapshot(grid)], 0
+    for _ in range(120):
+        action = rnd.random()
+        if action < .6:
+            edit(grid, history, rnd)
+            del states[position + 1:]
+            states.append(snapshot(grid))
+            position += 1
+        elif action < .85:
+            if history.undo() is not None:
+                position -= 1
+            else:
+                # history is empty or its oldest commands were dropped
+                assert budget == 'drop' or position == 0
+        elif history.redo() is not None:
+            position += 1
+        assert snapshot(grid) == states[position]
+    while history.undo() is not None:
+        position -= 1
+        assert snapshot(grid) == states[position]
+    if budget != 'drop':
+        assert position == 0
+    while history.redo() is not None:
+        position += 1
+        assert snapshot(grid) == states[position]
+
+
+def test_budgets_pack_and_spill():
+    grid = TileGrid(64, 64)
+    history = UndoStack(memory_budget=16 * 2 ** 10, disk_budget=2 ** 20)
+    rnd = random.Random(0)
+    states = [snapshot(grid)]
+    for _ in range(200):
+        edit(grid, history, rnd)
+        states.append(snapshot(grid))
+    assert history.memory_size <= 16 * 2 ** 10 + max(entry.size for entry in history._undo)
+    assert history.disk_size > 0
+    for state in reversed(states[:-1]):
+        if history.undo() is None:
+            break
+        assert snapshot(grid) == state
+
+
+class _Pose:
+    def __init__(self, x: float, y: float):
+        self.x, self.y = x, y
+
+
+class _Object:
+    def __init__(self, x: float, y: float):
+        self.position = [x, y]
+
+
+def test_transaction_merges_commands():
+    history = UndoStack()
+    pose, obj = _Pose(0., 0.), _Object(1., 1.)
+    history.begin_transaction()
+    for step in range(1, 4):
+        history.push(AttributesChange([(pose, 'x', pose.x, float(step))]))
+        pose.x = float(step)
+    history.commit()
+    history.begin_transaction()
+    for _ in range(5):
+        obj.position[0] += 1
+        history.push(ObjectsMoved([obj], 1, 0))
+    assert history.can_undo()
+    # undo commits open transaction
+    history.undo()
+    assert obj.position == [1., 1.] and pose.x == 3.
+    assert len(history) == 1
+    history.undo()
+    assert pose.x == 0.
+    assert not history.can_undo() and history.can_redo()
+    history.redo()
+    history.redo()
+    assert pose.x == 3. and obj.position == [6., 1.]
+
+
+class _LockedChange(UndoCommand):
+    """
+    Command w/ data, which can't be pickled
+    """
+
+    def __init__(self, pose: _Pose, before: float, after: float):
+        self.pose, self.before, self.after = pose, before, after
+        self.lock = threading.Lock()
+
+    def undo(self):
+        self.pose.x = self.before
+
+    def redo(self):
+        self.pose.x = self.after
+
+    def references(self) -> list:
+        return [self.pose]
+
+
+@pytest.mark.parametrize('budget', sorted(BUDGETS))
+def test_unpicklable_commands_stay_raw(budget):
+    memory_budget, disk_budget = BUDGETS[budget]
+    history = UndoStack(memory_budget=memory_budget // 16, disk_budget=disk_budget)
+    pose = _Pose(0., 0.)
+    for step in range(1, 200):
+        history.push(_LockedChange(pose, pose.x, float(step)))
+        pose.x = float(step)
+    assert history.memory_size <= memory_budget // 16 + max(entry.size for entry in history._undo)
+    while history.undo() is not None:
+        pass
+    # unpicklable commands can't be spilled, they are dropped beyond memory budget
+    assert pose.x == 0. if budget == 'raw' else pose.x > 0.
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from PyQt5 import QtCore, QtGui
+
+CHUNK_SIZE = 16  # side of chunk, tiles
+MAX_CHUNK_LEVEL = 7  # chunks are rendered with at most 2 ** MAX_CHUNK_LEVEL pixels per tile
+CHUNK_CACHE_PIXELS = 32 * 2 ** 20  # max count of pixels in all cached chunks
+VIEWPORT_CACHE_FACTOR = 2  # cache keeps at least so many viewports of chunks, whatever CHUNK_CACHE_PIXELS is
+
+
+class _QuadNode:
+    __slots__ = ('x', 'y', 'size', 'children')
+
+    def __init__(self, x: int, y: int, size: int, width: int, height: int):
+        self.x, self.y, self.size = x, y, size
+        self.children = []
+        if size > 1:
+            half = size // 2
+            for dx in (0, half):
+                for dy in (0, half):
+                    if x + dx < width and y + dy < height:
+                        self.children.append(_QuadNode(x + dx, y + dy, half, width, height))
+
+
+class ChunkQuadTree:
+    """
+    Region quadtree over grid of chunks (width x height), leaves are single chunks
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width, self.height = width, height
+        size = 1
+        while size < max(width, height):
+            size *= 2
+        self.root = _QuadNode(0, 0, size, width, height) if width and height else None
+
+    def query(self, x_min: int, y_min: int, x_max: int, y_max: int) -> List[Tuple[int, int]]:
+        """
+        Find chunks intersecting rectangle [x_min, x_max) x [y_min, y_max) (in chunks)
+        :return: list of (x, y) of chunks
+        """
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            if node.x >= x_max or node.y >= y_max or node.x + node.size <= x_min or node.y + node.size <= y_min:
+                continue
+            if node.size == 1:
+                found.append((node.x, node.y))
+            else:
+                stack.extend(node.children)
+        return found
+
+
+class TileChunkStore:
+    """
+    Tile layer split into CHUNK_SIZE x CHUNK_SIZE chunks, each pre-rendered into pixmap per level of detail
+    and per power-of-two resolution of tile. Chunks are kept in quadtree, so paint visits only visible chunks and
+    cost of paint depends on size of viewport, not size of map.
+    Changing of tile invalidates only chunk containing it
+    """
+
+    def __init__(self, draw_block, chunk_size: int = CHUNK_SIZE, max_pixels: int = CHUNK_CACHE_PIXELS):
+        """
+        :param draw_block: function(painter, tiles, i_range, j_range, origin, tile_size), that draws block of tiles,
+        tile (i_range.start, j_range.stop - 1) is at origin
+        :param chunk_size: side of chunk, tiles
+        :param max_pixels: max count of pixels in all cached chunks, it's raised to VIEWPORT_CACHE_FACTOR visible
+        areas if viewport needs more
+        """
+        self.draw_block = draw_block
+        self.chunk_size = chunk_size
+        self.max_pixels = max_pixels
+        self.tree: Optional[ChunkQuadTree] = None
+        self.rendered_chunks = 0  # count of chunks rendered during the last draw
+        self._dims = None
+        self._pixmaps = OrderedDict()  # (chunk x, chunk row, lod, level) -> QPixmap, LRU order
+        self._chunk_keys: Dict[Tuple[int, int], Set[Tuple]] = defaultdict(set)
+        self._pixels = 0
+        self._dirty_tiles = set()
+        self._full_dirty = False
+
+    def __len__(self):
+        return len(self._pixmaps)
+
+    def invalidate(self, tiles=None):
+        """
+        Mark tiles for re-rendering
+        :param tiles: iterable of (i, j); if None, all chunks will be re-rendered
+        :return: -
+        """
+        if tiles is None:
+            self._full_dirty = True
+        else:
+            self._dirty_tiles.update(tiles)
+
+    def clear(self):
+        self._pixmaps.clear()
+        self._chunk_keys.clear()
+        self._pixels = 0
+        self._dirty_tiles.clear()
+        self._full_dirty = False
+
+    def draw(self, painter: QtGui.QPainter, tiles, tile_size: float, view_rect: QtCore.QRectF, lod: int,
+             antialiasing: bool = True) -> bool:
+        """
+        Draw visible chunks of tile layer, rendering missing ones
+        :param painter: painter of viewer, transformed to map origin
+        :param tiles: tiles as 2d-list [i][j]
+        :param tile_size: side of tile, pixels
+        :param view_rect: visible area
+        :param lod: level of detail of viewer
+        :param antialiasing: render new chunks w/ antialiasing
+        :return: bool, False if tiles are too big for chunks (nothing was drawn)
+        """
+        self.rendered_chunks = 0
+        level = max(0, math.ceil(math.log2(tile_size))) if tile_size > 0 else 0
+        if level > MAX_CHUNK_LEVEL:
+            return False
+        dims = (len(tiles), len(tiles[0]))
+        if dims != self._dims or self._full_dirty:
+            self.clear()
+            self._dims = dims
+            self.tree = ChunkQuadTree(math.ceil(dims[0] / self.chunk_size), math.ceil(dims[1] / self.chunk_size))
+        for i, j in self._dirty_tiles:
+            self._drop_chunk((i // self.chunk_size, (dims[1] - 1 - j) // self.chunk_size))
+        self._dirty_tiles.clear()
+
+        chunk_side = tile_size * self.chunk_size
+        visible = self.tree.query(math.floor(view_rect.left() / chunk_side), math.floor(view_rect.top() / chunk_side),
+                                  math.ceil(view_rect.right() / chunk_side), math.ceil(view_rect.bottom() / chunk_side))
+        in_use = set()
+        visible_pixels = 0
+        for chunk in visible:
+            key = chunk + (lod, level)
+            pixmap = self._pixmaps.get(key)
+            if pixmap is None:
+                pixmap = self._render(tiles, chunk, 2 ** level, antialiasing)
+                self._store(key, pixmap)
+            else:
+                self._pixmaps.move_to_end(key)
+            in_use.add(key)
+            visible_pixels += pixmap.width() * pixmap.height()
+            target = QtCore.QRectF(chunk[0] * chunk_side, chunk[1] * chunk_side,
+                                   pixmap.width() / 2 ** level * tile_size, pixmap.height() / 2 ** level * tile_size)
+            painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+        self._evict(max(self.max_pixels, VIEWPORT_CACHE_FACTOR * visible_pixels), in_use)
+        return True
+
+    def _render(self, tiles, chunk: Tuple[int, int], tile_pixels: int, antialiasing: bool) -> QtGui.QPixmap:
+        self.rendered_chunks += 1
+        i_count, j_count = self._dims
+        i_start, row_start = chunk[0] * self.chunk_size, chunk[1] * self.chunk_size
+        i_stop, row_stop = min(i_count, i_start + self.chunk_size), min(j_count, row_start + self.chunk_size)
+        pixmap = QtGui.QPixmap((i_stop - i_start) * tile_pixels, (row_stop - row_start) * tile_pixels)
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing, antialiasing)
+        self.draw_block(painter, tiles, range(i_start, i_stop), range(j_count - row_stop, j_count - row_start),
+                        QtCore.QPointF(0, 0), tile_pixels)
+        painter.end()
+        return pixmap
+
+    def _store(self, key, pixmap: QtGui.QPixmap):
+        self._pixmaps[key] = pixmap
+        self._chunk_keys[key[:2]].add(key)
+        self._pixels += pixmap.width() * pixmap.height()
+
+    def _evict(self, max_pixels: int, in_use: Set[Tuple]):
+        """
+        Drop least recently used chunks until cache fits max_pixels. Chunks of the current paint are the most
+        recently used ones, and they are never dropped
+        :param max_pixels: max count of pixels in all cached chunks
+        :param in_use: keys of chunks drawn by the current paint
+        :return: -
+        """
+        while self._pixels > max_pixels and self._pixmaps:
+            old_key = next(iter(self._pixmaps))
+            if old_key in in_use:
+                break
+            old_pixmap = self._pixmaps.pop(old_key)
+            self._chunk_keys[old_key[:2]].discard(old_key)
+            self._pixels -= old_pixmap.width() * old_pixmap.height()
+
+    def _drop_chunk(self, chunk: Tuple[int, int]):
+        for key in self._chunk_keys.pop(chunk, ()):
+            pixmap = self._pixmaps.pop(key)
+            self._pixels -= pixmap.width() * pixmap.height()
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from classes.mapTile import MapTile
+
+ROTATION_STEP = 90  # rotation of tile is stored as count of steps
+MARGIN_SHARE = .5  # free margin of reallocated arrays as part of size of grid
+
+
+class TileGrid:
+    """
+    Compact storage of tile layer: uint16 codes of kinds and uint8 rotations in parallel arrays [y][x],
+    kinds are interned in table of grid (a few bytes per tile instead of object per tile).
+    Grid behaves like list of rows of MapTile, so it can be data of MapLayer: grid[y][x] is a view,
+    which reads and writes arrays. Block operations (fill, copy, trim) are array slices.
+    Arrays of grid may be views of larger stores w/ free margins around them, so adding of lines at any edge
+    writes only new tiles; store is reallocated w/ margins proportional to size of grid, when margin isn't enough
+    """
+
+    def __init__(self, height: int = 1, width: int = 0, tile: MapTile = None):
+        self.kinds: List[str] = []
+        self._codes: Dict[str, int] = {}
+        kind, rotation = (tile.kind, tile.rotation) if tile is not None else ('empty', 0)
+        self.kind_codes = np.full((height, width), self.intern(kind), dtype=np.uint16)
+        self.rotations = np.full((height, width), rotation // ROTATION_STEP, dtype=np.uint8)
+
+    @classmethod
+    def from_tiles(cls, tiles: List[List[MapTile]]) -> 'TileGrid':
+        """
+        Create grid from list of rows of tiles
+        :param tiles: list(list) of MapTile, rows must have the same length
+        :return: TileGrid
+        """
+        grid = cls(len(tiles), len(tiles[0]) if tiles else 0)
+        for y, row in enumerate(tiles):
+            for x, tile in enumerate(row):
+                grid.set(y, x, tile.kind, tile.rotation)
+        return grid
+
+    def to_tiles(self) -> List[List[MapTile]]:
+        return [[MapTile(self.kinds[code], rotation * ROTATION_STEP) for code, rotation in zip(codes, rotations)]
+                for codes, rotations in zip(self.kind_codes.tolist(), self.rotations.tolist())]
+
+    def intern(self, kind: str) -> int:
+        """
+        Get code of kind, kind is added to table, if it's new
+        :param kind: kind of tile
+        :return: int
+        """
+        code = self._codes.get(kind)
+        if code is None:
+            if len(self.kinds) > np.iinfo(np.uint16).max:
+                raise ValueError("Too many kinds of tiles")
+            code = self._codes[kind] = len(self.kinds)
+            self.kinds.append(kind)
+        return code
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.kind_codes.shape
+
+    def __len__(self):
+        return self.kind_codes.shape[0]
+
+    def __getitem__(self, y: int) -> 'TileRow':
+        if not -len(self) <= y < len(self):
+            raise IndexError(y)
+        return TileRow(self, y % len(self))
+
+    def __iter__(self) -> Iterator['TileRow']:
+        for y in range(len(self)):
+            yield TileRow(self, y)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def get(self, y: int, x: int) -> Tuple[str, int]:
+        """
+        :return: (kind, rotation in degrees) of tile
+        """
+        return self.kinds[self.kind_codes[y, x]], int(self.rotations[y, x]) * ROTATION_STEP
+
+    def set(self, y: int, x: int, kind: str, rotation: int = 0):
+        self.kind_codes[y, x] = self.intern(kind)
+        self.rotations[y, x] = rotation // ROTATION_STEP
+
+    def fill(self, y_slice: slice, x_slice: slice, tile: MapTile):
+        """
+        Fill block of tiles with copies of tile
+        :return: -
+        """
+        self.kind_codes[y_slice, x_slice] = self.intern(tile.kind)
+        self.rotations[y_slice, x_slice] = tile.rotation // ROTATION_STEP
+
+    def copy_block(self, y_slice: slice, x_slice: slice) -> 'TileGrid':
+        """
+        Get copy of block of tiles as new grid w/ the same kind table
+        :return: TileGrid
+        """
+        block = TileGrid.__new__(TileGrid)
+        block.kinds, block._codes = list(self.kinds), dict(self._codes)
+        block.kind_codes = self.kind_codes[y_slice, x_slice].copy()
+        block.rotations = self.rotations[y_slice, x_slice].copy()
+        return block
+
+    def paste_block(self, y: int, x: int, block: 'TileGrid'):
+        """
+        Write block of tiles to grid, top left corner of block is placed at (y, x); part outside grid is dropped
+        :return: -
+        """
+        codes = block.kind_codes
+        if block.kinds != self.kinds[:len(block.kinds)]:
+            # translate codes of block into kind table of grid
+            codes = np.array([self.intern(kind) for kind in block.kinds] or [0], dtype=np.uint16)[codes]
+        height, width = min(codes.shape[0], self.shape[0] - y), min(codes.shape[1], self.shape[1] - x)
+        self.kind_codes[y:y + height, x:x + width] = codes[:height, :width]
+        self.rotations[y:y + height, x:x + width] = block.rotations[:height, :width]
+
+    def pad(self, up: int, right: int, down: int, left: int, tile: MapTile) -> bool:
+        """
+        Add lines of tiles at the edges
+        :return: bool, True if lines were added inside margins of stores (old arrays are parts of new ones),
+        False if arrays were reallocated
+        """
+        height, width = self.shape
+        in_place = self._has_margins(up, right, down, left)
+        y, x = self._origin() if in_place else self._reallocate(up, right, down, left)
+        y_slice, x_slice = slice(y - up, y + height + down), slice(x - left, x + width + right)
+        self.kind_codes = self._store(self.kind_codes)[y_slice, x_slice]
+        self.rotations = self._store(self.rotations)[y_slice, x_slice]
+        code, rotation = self.intern(tile.kind), tile.rotation // ROTATION_STEP
+        for array, value in ((self.kind_codes, code), (self.rotations, rotation)):
+            array[:up] = value
+            array[up + height:] = value
+            array[up:up + height, :left] = value
+            array[up:up + height, left + width:] = value
+        return in_place
+
+    def shrink(self, up: int, right: int, down: int, left: int):
+        """
+        Remove lines at the edges w/o copying, lines stay in margins of stores (e.g. undo of pad)
+        :return: -
+        """
+        height, width = self.shape
+        y_slice, x_slice = slice(up, height - down), slice(left, width - right)
+        self.kind_codes, self.rotations = self.kind_codes[y_slice, x_slice], self.rotations[y_slice, x_slice]
+
+    @staticmethod
+    def _store(array: np.ndarray) -> np.ndarray:
+        """
+        Get array, which owns memory of view
+        """
+        base = array.base
+        if not isinstance(base, np.ndarray) or base.ndim != 2 or not base.flags.c_contiguous or not base.shape[1]:
+            return array
+        # strides of axes w/ one element are arbitrary
+        if any(size > 1 and stride != base_stride
+               for size, stride, base_stride in zip(array.shape, array.strides, base.strides)):
+            return array
+        return base
+
+    def _origin(self) -> Tuple[int, int]:
+        """
+        Get position of arrays in their stores
+        :return: (y, x)
+        """
+        origins = set()
+        for array in (self.kind_codes, self.rotations):
+            store = self._store(array)
+            offset = array.__array_interface__['data'][0] - store.__array_interface__['data'][0]
+            origins.add(divmod(offset // array.itemsize, store.shape[1]) if store is not array else (0, 0))
+        if len(origins) > 1:
+            raise ValueError("Arrays of grid aren't aligned")
+        return origins.pop()
+
+    def _has_margins(self, up: int, right: int, down: int, left: int) -> bool:
+        stores = self._store(self.kind_codes), self._store(self.rotations)
+        # position of empty view in store is unknown
+        if stores[0] is self.kind_codes or stores[1] is self.rotations or stores[0].shape != stores[1].shape or \
+                not self.kind_codes.size:
+            return False
+        y, x = self._origin()
+        height, width = self.shape
+        return y >= up and x >= left and y + height + down <= stores[0].shape[0] and \
+            x + width + right <= stores[0].shape[1]
+
+    def _reallocate(self, up: int, right: int, down: int, left: int) -> Tuple[int, int]:
+        """
+        Move arrays to new stores w/ margins, which are enough to add lines
+        :return: position of arrays in stores (y, x)
+        """
+        height, width = self.shape
+        margin_y, margin_x = int(height * MARGIN_SHARE) + 1, int(width * MARGIN_SHARE) + 1
+        top, bottom, before, after = up + margin_y, down + margin_y, left + margin_x, right + margin_x
+        arrays = []
+        for array in (self.kind_codes, self.rotations):
+            store = np.zeros((top + height + bottom, before + width + after), dtype=array.dtype)
+            store[top:top + height, before:before + width] = array
+            arrays.append(store[top:top + height, before:before + width])
+        self.kind_codes, self.rotations = arrays
+        return top, before
+
+    def crop(self, y_slice: slice, x_slice: slice):
+        """
+        Keep only block of tiles
+        :return: -
+        """
+        self.kind_codes = self.kind_codes[y_slice, x_slice].copy()
+        self.rotations = self.rotations[y_slice, x_slice].copy()
+
+
+class TileRow:
+    """
+    Row of TileGrid as sequence of tile views
+    """
+
+    def __init__(self, grid: TileGrid, y: int):
+        self.grid = grid
+        self.y = y
+
+    def __len__(self):
+        return self.grid.kind_codes.shape[1]
+
+    def __getitem__(self, x: int) -> 'GridTile':
+        if not -len(self) <= x < len(self):
+            raise IndexError(x)
+        return GridTile(self.grid, self.y, x % len(self))
+
+    def __setitem__(self, x: int, tile: MapTile):
+        self.grid.set(self.y, x, tile.kind, tile.rotation)
+
+    def __iter__(self) -> Iterator['GridTile']:
+        for x in range(len(self)):
+            yield GridTile(self.grid, self.y, x)
+
+
+class GridTile(MapTile):
+    """
+    MapTile, which reads and writes cell of TileGrid
+    """
+    __slots__ = ('grid', 'y', 'x')
+
+    def __init__(self, grid: TileGrid, y: int, x: int):
+        self.grid = grid
+        self.y = y
+        self.x = x
+
+    @property
+    def kind(self) -> str:
+        return self.grid.kinds[self.grid.kind_codes[self.y, self.x]]
+
+    @kind.setter
+    def kind(self, kind: str):
+        self.grid.kind_codes[self.y, self.x] = self.grid.intern(kind)
+
+    @property
+    def rotation(self) -> int:
+        return int(self.grid.rotations[self.y, self.x]) * ROTATION_STEP
+
+    @rotation.setter
+    def rotation(self, rotation: int):
+        self.grid.rotations[self.y, self.x] = rotation // ROTATION_STEP
+
+    def __copy__(self) -> MapTile:
+        # copy is detached from grid
+        return MapTile(self.kind, self.rotation)
+
+    def __deepcopy__(self, memo) -> MapTile:
+        return self.__copy__()
@@ -0,0 +1,670 @@
+# -*- coding: utf-8 -*-
+import copy
+import io
+import logging
+import pickle
+import sys
+import tempfile
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tile_grid import TileGrid
+
+logger = logging.getLogger('root')
+
+UNDO_MEMORY_BUDGET = 64 * 2 ** 20  # bytes of history in memory
+UNDO_RAW_SHARE = .5  # part of memory budget for the newest commands, which aren't compressed
+UNDO_DISK_BUDGET = 256 * 2 ** 20  # bytes of history spilled to temp files
+SPILL_SEGMENTS = 4  # temp files in ring
+
+
+class UndoCommand:
+    """
+    Change of map, which can be undone and redone. Command keeps only changed data,
+    so undo and redo take time proportional to size of change
+    """
+
+    def undo(self):
+        raise NotImplementedError("Subclasses should implement undo")
+
+    def redo(self):
+        raise NotImplementedError("Subclasses should implement redo")
+
+    def references(self) -> list:
+        """
+        Get live objects of map, which command changes. They are kept as references, when command is packed,
+        other data of command is pickled
+        :return: list
+        """
+        return []
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        """
+        Get attributes, which command changes, so views refresh only them after undo and redo
+        :return: list of (object, name of attribute)
+        """
+        return []
+
+    def merge(self, command: 'UndoCommand') -> bool:
+        """
+        Absorb command, which was applied right after this one, e.g. next step of drag
+        :param command: UndoCommand
+        :return: bool, True if command was merged
+        """
+        return False
+
+
+class MacroCommand(UndoCommand):
+    """
+    Commands, which are undone and redone together
+    """
+
+    def __init__(self, commands: List[UndoCommand]):
+        self.commands = commands
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def references(self) -> list:
+        return [obj for command in self.commands for obj in command.references()]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [change for command in self.commands for change in command.changed()]
+
+
+class TileBlockChange(UndoCommand):
+    """
+    Change of block of TileGrid, top left corner of block is (y, x)
+    """
+
+    def __init__(self, grid: TileGrid, y: int, x: int, before: TileGrid, after: TileGrid):
+        self.grid = grid
+        self.y, self.x = y, x
+        self.before = before
+        self.after = after
+
+    def undo(self):
+        self.grid.paste_block(self.y, self.x, self.before)
+
+    def redo(self):
+        self.grid.paste_block(self.y, self.x, self.after)
+
+    def references(self) -> list:
+        return [self.grid]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(self.grid, 'kind_codes'), (self.grid, 'rotations')]
+
+
+class TileGridResize(UndoCommand):
+    """
+    Replacing of arrays of TileGrid (adding and trimming of lines). Arrays aren't copied:
+    resize creates new arrays, and later changes are undone before this command.
+    Arrays after resize are taken on undo, as they are changed in place by later commands
+    """
+
+    def __init__(self, grid: TileGrid, before: Tuple):
+        self.grid = grid
+        self.before = before
+        self.after = None
+
+    def undo(self):
+        self.after = (self.grid.kind_codes, self.grid.rotations)
+        self.grid.kind_codes, self.grid.rotations = self.before
+
+    def redo(self):
+        self.grid.kind_codes, self.grid.rotations = self.after
+        self.after = None
+
+    def references(self) -> list:
+        return [self.grid]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(self.grid, 'kind_codes'), (self.grid, 'rotations')]
+
+
+class TileGridGrow(UndoCommand):
+    """
+    Adding of lines to TileGrid inside margins of its stores (see TileGrid.pad). Tiles aren't stored:
+    undo only moves edges of grid back, added lines stay in margins, and redo takes arrays, which were undone
+    """
+
+    def __init__(self, grid: TileGrid, lines: Tuple[int, int, int, int]):
+        """
+        :param lines: count of added lines (up, right, down, left)
+        """
+        self.grid = grid
+        self.lines = lines
+        self.after = None
+
+    def undo(self):
+        self.after = (self.grid.kind_codes, self.grid.rotations)
+        self.grid.shrink(*self.lines)
+
+    def redo(self):
+        self.grid.kind_codes, self.grid.rotations = self.after
+        self.after = None
+
+    def references(self) -> list:
+        return [self.grid]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(self.grid, 'kind_codes'), (self.grid, 'rotations')]
+
+
+class ObjectsRemoved(UndoCommand):
+    """
+    Removing of objects from MapLayer, objects get their ids and places back on undo
+    """
+
+    def __init__(self, layer, items: Sequence[Tuple[int, int, Any]]):
+        """
+        :param layer: MapLayer
+        :param items: list of (position, id, object) as they were before removing
+        """
+        self.layer = layer
+        self.items = items
+
+    def undo(self):
+        self.layer.insert_objects(self.items)
+
+    def redo(self):
+        self.layer.remove_objects([obj_id for _, obj_id, _ in self.items])
+
+    def references(self) -> list:
+        # objects stay the same after undo, as other commands refer to them
+        return [self.layer] + [obj for _, _, obj in self.items]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(self.layer, 'data')]
+
+
+class ObjectsAdded(ObjectsRemoved):
+    """
+    Adding of objects to MapLayer
+    """
+
+    def undo(self):
+        ObjectsRemoved.redo(self)
+
+    def redo(self):
+        ObjectsRemoved.undo(self)
+
+
+class ObjectsMoved(UndoCommand):
+    """
+    Shift of positions of objects of map layers
+    """
+
+    def __init__(self, objects: Sequence, dx: float, dy: float):
+        self.objects = objects
+        self.dx, self.dy = dx, dy
+
+    def merge(self, command: UndoCommand) -> bool:
+        if not isinstance(command, ObjectsMoved) or len(command.objects) != len(self.objects) or \
+                any(a is not b for a, b in zip(command.objects, self.objects)):
+            return False
+        self.dx += command.dx
+        self.dy += command.dy
+        return True
+
+    def _move(self, dx: float, dy: float):
+        for obj in self.objects:
+            obj.position[0] += dx
+            obj.position[1] += dy
+
+    def undo(self):
+        self._move(-self.dx, -self.dy)
+
+    def redo(self):
+        self._move(self.dx, self.dy)
+
+    def references(self) -> list:
+        return list(self.objects)
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(obj, 'position') for obj in self.objects]
+
+
+def copy_value(value):
+    """
+    Copy value of attribute, if it can be changed in place (e.g. members of group, camera matrix)
+    """
+    return copy.deepcopy(value) if isinstance(value, (list, dict)) else value
+
+
+class AttributesChange(UndoCommand):
+    """
+    Change of attributes of any objects (e.g. type and orientation of dt-world tiles, poses of frames)
+    """
+
+    def __init__(self, changes: Sequence[Tuple[Any, str, Any, Any]]):
+        """
+        :param changes: list of (object, name of attribute, old value, new value), lists must be copies
+        """
+        self.changes = changes
+
+    @staticmethod
+    def _set(obj, name: str, value):
+        current = getattr(obj, name, None)
+        if isinstance(value, list) and isinstance(current, list):
+            # list may be shared (e.g. members of group), so it's kept
+            current[:] = copy.deepcopy(value)
+        else:
+            setattr(obj, name, copy_value(value))
+
+    def undo(self):
+        for obj, name, old, _ in reversed(self.changes):
+            self._set(obj, name, old)
+
+    def redo(self):
+        for obj, name, _, new in self.changes:
+            self._set(obj, name, new)
+
+    def merge(self, command: UndoCommand) -> bool:
+        if not isinstance(command, AttributesChange):
+            return False
+        # the first old value and the last new value are kept for each attribute
+        index = {(id(obj), name): i for i, (obj, name, _, _) in enumerate(self.changes)}
+        changes = list(self.changes)
+        for obj, name, old, new in command.changes:
+            i = index.get((id(obj), name))
+            if i is None:
+                index[(id(obj), name)] = len(changes)
+                changes.append((obj, name, old, new))
+            else:
+                changes[i] = changes[i][:3] + (new,)
+        self.changes = changes
+        return True
+
+    def references(self) -> list:
+        return [obj for obj, _, _, _ in self.changes]
+
+    def changed(self) -> List[Tuple[Any, str]]:
+        return [(obj, name) for obj, name, _, _ in self.changes]
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file: BinaryIO, references: list):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self._indexes = {id(obj): i for i, obj in enumerate(references)}
+
+    def persistent_id(self, obj):
+        return self._indexes.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file: BinaryIO, references: list):
+        pickle.Unpickler.__init__(self, file)
+        self._references = references
+
+    def persistent_load(self, pid):
+        return self._references[pid]
+
+
+def _dump(command: UndoCommand, references: list) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, references).dump(command)
+    return buffer.getvalue()
+
+
+def _estimate_size(command: UndoCommand, references: list) -> int:
+    """
+    Approximate memory of data of command w/o pickling: arrays by their buffers, containers and objects
+    by their items and attributes. Live objects of map (references) aren't counted
+    """
+    seen = {id(obj) for obj in references}
+    size = 0
+    stack = [command]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+            continue
+        size += sys.getsizeof(value)
+        if isinstance(value, (str, bytes, int, float, type)):
+            continue
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset, deque)):
+            stack.extend(value)
+        else:
+            if hasattr(value, '__dict__'):
+                stack.extend(vars(value).values())
+            for cls in type(value).__mro__:
+                stack.extend(getattr(value, slot) for slot in getattr(cls, '__slots__', ())
+                             if hasattr(value, slot))
+    return size
+
+
+class SpillRing:
+    """
+    Ring of temp files for packed commands. When the current file is full, writing goes on to the next one;
+    the oldest file is truncated and its records become unreadable
+    """
+
+    def __init__(self, budget: int = UNDO_DISK_BUDGET, segments: int = SPILL_SEGMENTS):
+        self.segment_size = budget // segments
+        self._files: List[Optional[BinaryIO]] = [None] * segments
+        self._sizes = [0] * segments
+        self._generations = [0] * segments
+        self._current = 0
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes)
+
+    def write(self, blob: bytes) -> Optional[Tuple[int, int, int, int]]:
+        """
+        :param blob: bytes
+        :return: location of record (segment, generation, offset, length), None if record doesn't fit segment
+        """
+        if len(blob) > self.segment_size:
+            return None
+        segment = self._current
+        if self._sizes[segment] + len(blob) > self.segment_size:
+            segment = self._current = (segment + 1) % len(self._files)
+            self._sizes[segment] = 0
+            self._generations[segment] += 1
+            if self._files[segment] is not None:
+                self._files[segment].truncate(0)
+        if self._files[segment] is None:
+            self._files[segment] = tempfile.TemporaryFile(prefix='map-editor-undo-')
+        file = self._files[segment]
+        offset = self._sizes[segment]
+        file.seek(offset)
+        file.write(blob)
+        self._sizes[segment] += len(blob)
+        return segment, self._generations[segment], offset, len(blob)
+
+    def is_valid(self, location: Tuple[int, int, int, int]) -> bool:
+        return self._generations[location[0]] == location[1]
+
+    def read(self, location: Tuple[int, int, int, int]) -> Optional[bytes]:
+        """
+        :return: bytes of record, None if record is overwritten
+        """
+        if not self.is_valid(location):
+            return None
+        segment, _, offset, length = location
+        file = self._files[segment]
+        file.seek(offset)
+        return file.read(length)
+
+    def clear(self):
+        for segment, file in enumerate(self._files):
+            if file is not None:
+                file.close()
+            self._files[segment] = None
+            self._sizes[segment] = 0
+            self._generations[segment] += 1
+
+
+class _Entry:
+    """
+    Command in history: raw, packed (zlib-compressed pickle) in memory or spilled to SpillRing.
+    Live objects of map stay references in any state. Command, which can't be pickled, stays raw,
+    when it's packed, and is dropped instead of spilling.
+    Size is estimated for raw command and is size of blob for packed one
+    """
+    __slots__ = ('command', 'references', 'blob', 'location', 'size')
+
+    def __init__(self, command: UndoCommand):
+        self.command = command
+        self.references = command.references()
+        self.blob = None
+        self.location = None
+        self.size = _estimate_size(command, self.references)
+
+    def pack(self) -> bool:
+        """
+        :return: bool, False if command can't be pickled (it's kept raw)
+        """
+        try:
+            blob = zlib.compress(_dump(self.command, self.references))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning("Can't pack command {}: {}".format(type(self.command).__name__, e))
+            return False
+        self.blob = blob
+        self.command = None
+        self.size = len(blob)
+        return True
+
+    def spill(self, ring: SpillRing) -> bool:
+        if self.blob is None:
+            return False
+        self.location = ring.write(self.blob)
+        self.blob = None
+        return self.location is not None
+
+    def load(self, ring: SpillRing) -> Optional[UndoCommand]:
+        if self.command is None:
+            blob = self.blob if self.blob is not None else ring.read(self.location)
+            if blob is None:
+                return None
+            self.command = _Unpickler(io.BytesIO(zlib.decompress(blob)), self.references).load()
+            self.blob = self.location = None
+        return self.command
+
+
+class UndoStack:
+    """
+    History of commands for undo and redo. Pushing of new command clears redo history.
+    Commands pushed inside transaction (begin_transaction/commit or macro()) are undone as one,
+    adjacent commands of transaction are merged, so e.g. a burst of nudges becomes one shift.
+    History is limited by bytes: the newest commands are kept as is, older ones are packed into
+    zlib-compressed pickles, the oldest are spilled to temp files, commands beyond disk budget are dropped.
+    Undo loads packed commands transparently
+    """
+
+    def __init__(self, memory_budget: int = UNDO_MEMORY_BUDGET, disk_budget: int = UNDO_DISK_BUDGET):
+        """
+        :param memory_budget: bytes of raw and packed commands in memory
+        :param disk_budget: bytes of spilled commands, 0 - spilling is disabled
+        """
+        self.raw_budget = int(memory_budget * UNDO_RAW_SHARE)
+        self.packed_budget = memory_budget - self.raw_budget
+        self._ring = SpillRing(disk_budget) if disk_budget > 0 else None
+        # entries are ordered: spilled, packed, raw (the newest)
+        self._undo = deque()
+        self._spilled = 0
+        self._packed = 0
+        self._raw_bytes = 0
+        self._packed_bytes = 0
+        self._redo: List[UndoCommand] = []
+        self._macros: List[List[UndoCommand]] = []
+        self.changed: Optional[Callable[[], None]] = None  # called after each change of history
+
+    def __len__(self):
+        return len(self._undo)
+
+    def can_undo(self) -> bool:
+        # open transaction is committed by undo
+        return bool(self._undo) or any(self._macros)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    @property
+    def memory_size(self) -> int:
+        """
+        :return: approximate bytes of history in memory
+        """
+        return self._raw_bytes + self._packed_bytes
+
+    @property
+    def disk_size(self) -> int:
+        """
+        :return: bytes of temp files of history
+        """
+        return self._ring.size if self._ring is not None else 0
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        for commands in self._macros:
+            commands.clear()
+        self._spilled = self._packed = self._raw_bytes = self._packed_bytes = 0
+        if self._ring is not None:
+            self._ring.clear()
+        self._notify()
+
+    def push(self, command: UndoCommand):
+        """
+        Add command, which is already applied
+        :param command: UndoCommand
+        :return: -
+        """
+        if self._macros:
+            commands = self._macros[-1]
+            if not commands or not commands[-1].merge(command):
+                commands.append(command)
+            self._notify()
+            return
+        self._append(command)
+        self._redo.clear()
+        self._notify()
+
+    def begin_transaction(self):
+        """
+        Start group of commands, which becomes one step of history on commit.
+        Transaction may last over several events (e.g. drag or held keys), transactions can be nested
+        :return: -
+        """
+        self._macros.append([])
+
+    def commit(self):
+        """
+        Finish the innermost transaction; nothing is done, if there is no transaction
+        :return: -
+        """
+        if not self._macros:
+            return
+        commands = self._macros.pop()
+        if len(commands) == 1:
+            self.push(commands[0])
+        elif commands:
+            self.push(MacroCommand(commands))
+
+    @contextmanager
+    def macro(self):
+        """
+        Group commands pushed inside `with` block into one
+        """
+        self.begin_transaction()
+        try:
+            yield
+        finally:
+            self.commit()
+
+    def undo(self) -> Optional[UndoCommand]:
+        """
+        Undo last command, open transactions are committed before
+        :return: undone command, None if history is empty
+        """
+        self._commit_all()
+        command = self._pop()
+        if command is None:
+            return None
+        command.undo()
+        self._redo.append(command)
+        self._notify()
+        return command
+
+    def redo(self) -> Optional[UndoCommand]:
+        """
+        Redo last undone command
+        :return: redone command, None if there is nothing to redo
+        """
+        self._commit_all()
+        if not self._redo:
+            return None
+        command = self._redo.pop()
+        command.redo()
+        self._append(command)
+        self._notify()
+        return command
+
+    def _commit_all(self):
+        while self._macros:
+            self.commit()
+
+    def _append(self, command: UndoCommand):
+        entry = _Entry(command)
+        self._undo.append(entry)
+        self._raw_bytes += entry.size
+        self._balance()
+
+    def _pop(self) -> Optional[UndoCommand]:
+        while self._undo:
+            entry = self._undo.pop()
+            if len(self._undo) < self._spilled:
+                self._spilled -= 1
+            elif len(self._undo) < self._spilled + self._packed:
+                self._packed -= 1
+                self._packed_bytes -= entry.size
+            else:
+                self._raw_bytes -= entry.size
+            command = entry.load(self._ring)
+            if command is not None:
+                return command
+            logger.warning("Undo history is lost, spilled command was overwritten")
+            self._undo.clear()
+            self._spilled = self._packed = self._raw_bytes = self._packed_bytes = 0
+        return None
+
+    def _balance(self):
+        # the oldest raw entries are packed, the oldest packed ones are spilled, while budgets are exceeded
+        raw_start = self._spilled + self._packed
+        while self._raw_bytes > self.raw_budget and raw_start < len(self._undo) - 1:
+            entry = self._undo[raw_start]
+            self._raw_bytes -= entry.size
+            entry.pack()
+            self._packed += 1
+            self._packed_bytes += entry.size
+            raw_start += 1
+        while self._packed_bytes > self.packed_budget and self._packed:
+            entry = self._undo[self._spilled]
+            self._packed -= 1
+            self._packed_bytes -= entry.size
+            if self._ring is not None and entry.spill(self._ring):
+                self._spilled += 1
+            else:
+                # entry is the oldest one in memory, all spilled entries are older
+                self._undo.remove(entry)
+                self._drop_spilled(self._spilled)
+        # ring overwrites the oldest records
+        while self._spilled and not self._ring.is_valid(self._undo[0].location):
+            self._drop_oldest()
+
+    def _drop_spilled(self, count: int):
+        for _ in range(count):
+            self._undo.popleft()
+        self._spilled -= count
+
+    def _drop_oldest(self):
+        entry = self._undo.popleft()
+        if self._spilled:
+            self._spilled -= 1
+        elif self._packed:
+            self._packed -= 1
+            self._packed_bytes -= entry.size
+        else:
+            self._raw_bytes -= entry.size
+
+    def _notify(self):
+        if self.changed is not None:
+            self.changed()